@@ -6,7 +6,18 @@ __version__ = "1.0.0"
 __author__ = "RAG Agent Project"
 __description__ = "A modular RAG agent for development assistance with local and cloud AI models"
 
-from .config import config_manager
-from .agent import rag_agent
+__all__ = ["config_manager", "get_rag_agent", "rag_agent"]
 
-__all__ = ["config_manager", "rag_agent"]
+def __getattr__(name):
+    """Resolve exports lazily so importing a submodule (e.g. in a parser worker
+    process) doesn't load the config or build the agent."""
+    if name == "config_manager":
+        from .config import config_manager
+        return config_manager
+    if name == "get_rag_agent":
+        from .agent import get_rag_agent
+        return get_rag_agent
+    if name == "rag_agent":
+        from .agent import get_rag_agent
+        return get_rag_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
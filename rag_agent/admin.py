@@ -4,33 +4,279 @@ Provides system monitoring, user management, and advanced configuration.
 """
 
 import streamlit as st
+import atexit
+import collections
+import hashlib
+import hmac
 import json
+import os
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Dict, Any, Iterator, List, NamedTuple, Optional
 import logging
 
-try:
-    from .security import security_manager, rate_limiter
-    from .performance import monitor, cache
-    from .session_management import session_manager, session_isolation
-    from .prompt_engineering import prompt_manager, prompt_optimizer
-    from .code_execution import safe_executor, code_analyzer
-except ImportError:
-    # Handle missing optional features gracefully
-    security_manager = None
-    rate_limiter = None
-    monitor = None
-    cache = None
-    session_manager = None
-    session_isolation = None
-    prompt_manager = None
-    prompt_optimizer = None
-    safe_executor = None
-    code_analyzer = None
-
 logger = logging.getLogger(__name__)
 
+_ADMIN_DEP_NAMES = (
+    "security_manager", "rate_limiter", "monitor", "cache", "session_manager",
+    "session_isolation", "prompt_manager", "prompt_optimizer", "safe_executor", "code_analyzer",
+)
+
+@lru_cache(maxsize=1)
+def _load_admin_deps() -> SimpleNamespace:
+    """Import the admin panel's backing services on first use."""
+    try:
+        import psutil
+        # Seed the CPU sampler so later non-blocking reads report real usage
+        psutil.cpu_percent()
+    except ImportError:
+        psutil = None
+    
+    try:
+        from .security import security_manager, rate_limiter
+        from .performance import monitor, cache
+        from .session_management import session_manager, session_isolation
+        from .prompt_engineering import prompt_manager, prompt_optimizer
+        from .code_execution import safe_executor, code_analyzer
+    except ImportError:
+        # Handle missing optional features gracefully
+        return SimpleNamespace(psutil=psutil, **dict.fromkeys(_ADMIN_DEP_NAMES))
+    
+    return SimpleNamespace(
+        psutil=psutil,
+        security_manager=security_manager,
+        rate_limiter=rate_limiter,
+        monitor=monitor,
+        cache=cache,
+        session_manager=session_manager,
+        session_isolation=session_isolation,
+        prompt_manager=prompt_manager,
+        prompt_optimizer=prompt_optimizer,
+        safe_executor=safe_executor,
+        code_analyzer=code_analyzer,
+    )
+
+def __getattr__(name: str) -> Any:
+    """Expose the lazily loaded services as module attributes."""
+    if name in _ADMIN_DEP_NAMES:
+        return getattr(_load_admin_deps(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Digest of the admin password; set ADMIN_PASSWORD in production!
+_ADMIN_PASSWORD_HASH = hashlib.sha256(os.environ.get("ADMIN_PASSWORD", "admin123").encode()).digest()
+
+_ADMIN_TABS = (
+    "📊 System Monitor", "👥 User Management", "🚀 Performance",
+    "🎛️ Prompt Management", "🔒 Security", "⚙️ Advanced Settings",
+)
+_ADMIN_LOGIN_COLS = (1, 2, 1)
+_TEMPLATE_COLS = (2, 1)
+_CATEGORIES = ("development", "analysis", "creative", "research", "custom")
+_ALLOWED_EXT_CHOICES = (".pdf", ".docx", ".xlsx", ".csv", ".txt", ".md", ".py", ".js", ".html", ".json")
+_DEFAULT_ALLOWED_EXT = (".pdf", ".docx", ".txt", ".md", ".py")
+_CONTEXT_STRATEGIES = ("balanced", "prefer_recent", "prefer_context", "adaptive")
+_RATE_LIMITS_INFO = (
+    ("Chat Requests", "60 per hour"),
+    ("File Uploads", "10 per hour"),
+    ("API Calls", "100 per hour"),
+)
+
+# Path probed for disk usage: the filesystem holding the app's data, else the system root.
+# The probe runs with a timeout so a stuck network mount can't block reruns
+_SYSTEM_ROOT = os.environ.get("SystemDrive", "C:") + "\\" if os.name == "nt" else "/"
+_STAT_PATH = os.environ.get("RAG_STAT_PATH") or (os.path.abspath("data") if os.path.isdir("data") else _SYSTEM_ROOT)
+_DISK_PROBE_TIMEOUT = 0.25
+_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="admin-disk-probe")
+
+_USERS_PAGE_SIZE = 50
+_TEMPLATES_PAGE_SIZE = 20
+# Cached pages per table; revisions only grow, so stale ones must be evicted
+_PAGE_CACHE_ENTRIES = 8
+
+_LEVEL_ICONS = {"INFO": "🟢", "WARNING": "🟡", "ERROR": "🔴", "CRITICAL": "🔴"}
+_TEMPLATE_VAR_RE = re.compile(r'\{(\w+)\}')
+
+@lru_cache(maxsize=128)
+def _extract_vars(text: str) -> tuple:
+    """Return the unique ``{name}`` placeholders in a template, in order of appearance."""
+    seen = {}
+    for match in _TEMPLATE_VAR_RE.finditer(text):
+        seen[match.group(1)] = None
+    return tuple(seen)
+
+def _update_vars():
+    """Refresh detected template variables when the template content changes."""
+    st.session_state["tpl_vars"] = list(_extract_vars(st.session_state.get("tpl_content") or ""))
+
+class _RingBufferHandler(logging.Handler):
+    """Logging handler that keeps the most recent records in memory."""
+    
+    def __init__(self, maxlen: int = 200):
+        super().__init__()
+        self.ring = collections.deque(maxlen=maxlen)
+    
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.ring.append((record.created, record.levelname, record.getMessage()))
+        except Exception:
+            self.handleError(record)
+
+def _install_log_ring() -> collections.deque:
+    """Attach the ring buffer handler to the root logger once per process."""
+    root = logging.getLogger()
+    for handler in root.handlers:
+        # Streamlit may re-import this module; reuse the existing buffer
+        if handler.get_name() == "rag_agent.admin.ring":
+            return handler.ring
+    handler = _RingBufferHandler()
+    handler.set_name("rag_agent.admin.ring")
+    root.addHandler(handler)
+    return handler.ring
+
+_LOG_RING = _install_log_ring()
+
+class SysSample(NamedTuple):
+    """Snapshot of host resource usage."""
+    cpu: float
+    mem_percent: float
+    mem_used: int
+    disk_percent: Optional[float]
+    disk_used: Optional[int]
+
+@st.cache_data(ttl=2.0, show_spinner=False)
+def _sample_system() -> SysSample:
+    """Sample CPU, memory and disk usage (cached briefly across reruns)."""
+    psutil = _load_admin_deps().psutil
+    memory = psutil.virtual_memory()
+    
+    future = _EXECUTOR.submit(psutil.disk_usage, _STAT_PATH)
+    try:
+        disk = future.result(timeout=_DISK_PROBE_TIMEOUT)
+    except FutureTimeoutError:
+        logger.warning(f"Disk usage probe for {_STAT_PATH} timed out")
+        disk = None
+    
+    return SysSample(
+        cpu=psutil.cpu_percent(interval=None),
+        mem_percent=memory.percent,
+        mem_used=memory.used,
+        disk_percent=(disk.used / disk.total) * 100 if disk else None,
+        disk_used=disk.used if disk else None,
+    )
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _cached_session_stats() -> Dict[str, Any]:
+    """Session statistics, cached briefly across reruns."""
+    return _load_admin_deps().session_manager.get_session_stats()
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _cached_template_stats() -> Dict[str, Any]:
+    """Prompt template statistics, cached briefly across reruns."""
+    return _load_admin_deps().prompt_manager.get_template_stats()
+
+# Session edits are persisted by a background flusher instead of inside the rerun;
+# template edits go through PromptManager's own debounced writer
+_DIRTY = threading.Event()
+_FLUSH_DELAY = 0.5
+_flusher_lock = threading.Lock()
+_flusher_thread = None
+
+def _flush_admin_data():
+    """Write session data to disk."""
+    deps = _load_admin_deps()
+    if deps.session_manager:
+        deps.session_manager._save_data()
+
+def _flusher():
+    """Coalesce bursts of admin edits into a single write."""
+    while True:
+        _DIRTY.wait()
+        time.sleep(_FLUSH_DELAY)
+        _DIRTY.clear()
+        try:
+            _flush_admin_data()
+        except Exception as e:
+            logger.error(f"Error flushing admin data: {e}")
+
+def _flush_on_exit():
+    """Persist any edits still pending at interpreter shutdown."""
+    if _DIRTY.is_set():
+        _DIRTY.clear()
+        _flush_admin_data()
+
+def _schedule_save():
+    """Mark session data dirty; the background flusher saves it shortly after."""
+    global _flusher_thread
+    with _flusher_lock:
+        if _flusher_thread is None:
+            _flusher_thread = threading.Thread(target=_flusher, daemon=True, name="admin-flusher")
+            _flusher_thread.start()
+            atexit.register(_flush_on_exit)
+    _DIRTY.set()
+
+@st.cache_data(max_entries=_PAGE_CACHE_ENTRIES, show_spinner=False)
+def _user_page(revision: int, offset: int, limit: int) -> List[Dict[str, Any]]:
+    """One page of user rows sorted by username; ``revision`` keys the cache."""
+    users = sorted(_load_admin_deps().session_manager.users.values(), key=lambda u: u.username.lower())
+    return [
+        {
+            "id": user.id,
+            "user": user.username,
+            "email": user.email or "",
+            "created": user.created_at,
+            "last_active": user.last_active,
+            "active": user.is_active,
+            "prefs": json.dumps(user.preferences, separators=(",", ":")),
+        }
+        for user in users[offset:offset + limit]
+    ]
+
+@st.cache_data(max_entries=_PAGE_CACHE_ENTRIES, show_spinner=False)
+def _template_page(revision: int, offset: int, limit: int) -> List[str]:
+    """One page of active template IDs sorted by name; ``revision`` keys the cache."""
+    templates = sorted(
+        (t for t in _load_admin_deps().prompt_manager.templates.values() if t.is_active),
+        key=lambda t: t.name.lower(),
+    )
+    return [template.id for template in templates[offset:offset + limit]]
+
+def _page_selector(total: int, page_size: int, key: str) -> int:
+    """Render a page number input when the list spans more than one page."""
+    pages = max(1, -(-total // page_size))
+    if pages == 1:
+        return 1
+    return st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+
+def _metric_row(items):
+    """Render (label, value[, delta]) tuples as a row of metrics."""
+    for col, (label, value, *delta) in zip(st.columns(len(items)), items):
+        col.metric(label, value, delta[0] if delta else None)
+
+def _stream_code_output(code: str) -> str:
+    """Stream sandboxed output into the page as a code block; returns the full output."""
+    def fenced() -> Iterator[str]:
+        yield "```text\n"
+        yield from _load_admin_deps().safe_executor.stream_execute(code)
+        yield "\n```"
+    
+    return st.write_stream(fenced())
+
+def _perf_summary(monitor) -> Dict[str, Any]:
+    """Performance summary, recomputed only when the monitor records something new."""
+    revision = monitor.revision
+    cached = st.session_state.get("_perf_cache")
+    if cached and cached[0] == revision:
+        return cached[1]
+    
+    summary = monitor.get_performance_summary()
+    st.session_state["_perf_cache"] = (revision, summary)
+    return summary
+
 def show_admin_panel():
     """Display the admin panel with system monitoring and management."""
     st.title("🔧 Admin Panel")
@@ -43,27 +289,16 @@ def show_admin_panel():
     # Admin navigation
     admin_tab = st.selectbox(
         "Admin Section:",
-        ["📊 System Monitor", "👥 User Management", "🚀 Performance", "🎛️ Prompt Management", "🔒 Security", "⚙️ Advanced Settings"]
+        _ADMIN_TABS
     )
     
-    if admin_tab == "📊 System Monitor":
-        show_system_monitor()
-    elif admin_tab == "👥 User Management":
-        show_user_management()
-    elif admin_tab == "🚀 Performance":
-        show_performance_monitor()
-    elif admin_tab == "🎛️ Prompt Management":
-        show_prompt_management()
-    elif admin_tab == "🔒 Security":
-        show_security_panel()
-    elif admin_tab == "⚙️ Advanced Settings":
-        show_advanced_settings()
+    _PANEL_DISPATCH[admin_tab]()
 
 def show_admin_login():
     """Simple admin login interface."""
     st.info("🔐 Admin access required")
     
-    col1, col2, col3 = st.columns([1, 2, 1])
+    col1, col2, col3 = st.columns(_ADMIN_LOGIN_COLS)
     
     with col2:
         st.subheader("Admin Login")
@@ -72,7 +307,7 @@ def show_admin_login():
         
         if st.button("Login", use_container_width=True):
             # Simple password check (in production, use proper authentication)
-            if admin_password == "admin123":  # Change this in production!
+            if hmac.compare_digest(hashlib.sha256(admin_password.encode()).digest(), _ADMIN_PASSWORD_HASH):
                 st.session_state.admin_mode = True
                 st.success("✅ Admin access granted")
                 st.rerun()
@@ -84,49 +319,19 @@ def show_admin_login():
 
 def show_system_monitor():
     """System monitoring dashboard."""
-    st.subheader("📊 System Monitor")
+    deps = _load_admin_deps()
     
-    # System metrics
-    col1, col2, col3, col4 = st.columns(4)
+    st.subheader("📊 System Monitor")
     
-    try:
-        import psutil
-        
-        with col1:
-            cpu_percent = psutil.cpu_percent()
-            st.metric("CPU Usage", f"{cpu_percent}%", delta=None)
-        
-        with col2:
-            memory = psutil.virtual_memory()
-            st.metric("Memory Usage", f"{memory.percent}%", delta=f"{memory.used // (1024**3)} GB")
-        
-        with col3:
-            disk = psutil.disk_usage('/')
-            disk_percent = (disk.used / disk.total) * 100
-            st.metric("Disk Usage", f"{disk_percent:.1f}%", delta=f"{disk.used // (1024**3)} GB")
-        
-        with col4:
-            # Active sessions
-            active_sessions = len(st.session_state.get('chat_sessions', {}))
-            st.metric("Active Sessions", active_sessions)
-    
-    except ImportError:
-        st.warning("psutil not available - showing demo data")
-        with col1:
-            st.metric("CPU Usage", "45%")
-        with col2:
-            st.metric("Memory Usage", "62%", delta="8.2 GB")
-        with col3:
-            st.metric("Disk Usage", "34%", delta="256 GB")
-        with col4:
-            st.metric("Active Sessions", "3")
+    # System metrics (refreshed on their own timer)
+    _system_metrics_fragment()
     
     st.divider()
     
     # Performance metrics
-    if monitor:
+    if deps.monitor:
         st.subheader("Performance Metrics")
-        perf_summary = monitor.get_performance_summary()
+        perf_summary = _perf_summary(deps.monitor)
         
         col1, col2 = st.columns(2)
         
@@ -135,72 +340,136 @@ def show_system_monitor():
             st.json(perf_summary)
         
         with col2:
-            if cache:
+            if deps.cache:
                 st.write("**Cache Statistics:**")
-                cache_stats = cache.get_stats()
+                cache_stats = deps.cache.get_stats()
                 st.json(cache_stats)
     
     # Recent logs
+    _recent_logs_fragment()
+
+@st.fragment(run_every=5.0)
+def _system_metrics_fragment():
+    """Render host metrics; reruns every few seconds without rerunning the page."""
+    deps = _load_admin_deps()
+    
+    active_sessions = len(st.session_state.get('chat_sessions', {}))
+    
+    if deps.psutil is not None:
+        sample = _sample_system()
+        if sample.disk_used is None:
+            disk_metric = ("Disk Usage", "n/a")
+        else:
+            disk_metric = ("Disk Usage", f"{sample.disk_percent:.1f}%", f"{sample.disk_used >> 30} GB")
+        
+        _metric_row((
+            ("CPU Usage", f"{sample.cpu}%"),
+            ("Memory Usage", f"{sample.mem_percent}%", f"{sample.mem_used >> 30} GB"),
+            disk_metric,
+            ("Active Sessions", active_sessions),
+        ))
+    
+    else:
+        st.warning("psutil not available - showing demo data")
+        _metric_row((
+            ("CPU Usage", "45%"),
+            ("Memory Usage", "62%", "8.2 GB"),
+            ("Disk Usage", "34%", "256 GB"),
+            ("Active Sessions", "3"),
+        ))
+
+@st.fragment
+def _recent_logs_fragment():
+    """Render recent activity as a single table."""
     st.subheader("Recent Activity")
     try:
-        # Show recent log entries (simplified)
-        log_entries = [
-            {"time": "2024-01-15 10:30:25", "level": "INFO", "message": "New chat session created"},
-            {"time": "2024-01-15 10:29:15", "level": "INFO", "message": "Document uploaded successfully"},
-            {"time": "2024-01-15 10:28:05", "level": "WARN", "message": "Model response took longer than expected"},
-            {"time": "2024-01-15 10:27:30", "level": "INFO", "message": "User configuration updated"},
-        ]
+        # Snapshot the in-memory log buffer, newest first
+        log_entries = list(_LOG_RING)
+        log_entries.reverse()
         
-        for entry in log_entries:
-            level_color = {"INFO": "🟢", "WARN": "🟡", "ERROR": "🔴"}.get(entry["level"], "⚪")
-            st.text(f"{level_color} {entry['time']} - {entry['message']}")
+        if not log_entries:
+            st.info("No recent activity")
+            return
+        
+        st.dataframe(
+            [
+                {
+                    "icon": _LEVEL_ICONS.get(level, "⚪"),
+                    "time": datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M:%S"),
+                    "level": level,
+                    "message": message,
+                }
+                for created, level, message in log_entries
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
     
     except Exception as e:
         st.error(f"Error loading logs: {e}")
 
 def show_user_management():
     """User management interface."""
+    deps = _load_admin_deps()
+    
     st.subheader("👥 User Management")
     
-    if not session_manager:
+    if not deps.session_manager:
         st.warning("Session management not available")
         return
     
     # Session statistics
-    session_stats = session_manager.get_session_stats()
+    session_stats = _cached_session_stats()
     
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("Total Users", session_stats.get("total_users", 0))
-    with col2:
-        st.metric("Active Users", session_stats.get("active_users", 0))
-    with col3:
-        st.metric("Active Sessions", session_stats.get("active_sessions", 0))
+    _metric_row((
+        ("Total Users", session_stats.get("total_users", 0)),
+        ("Active Users", session_stats.get("active_users", 0)),
+        ("Active Sessions", session_stats.get("active_sessions", 0)),
+    ))
     
     st.divider()
     
     # User list
     st.subheader("Users")
     
-    for user_id, user in session_manager.users.items():
-        with st.expander(f"👤 {user.username} ({user.email or 'No email'})"):
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.write(f"**ID:** {user.id}")
-                st.write(f"**Created:** {user.created_at.strftime('%Y-%m-%d %H:%M')}")
-                st.write(f"**Last Active:** {user.last_active.strftime('%Y-%m-%d %H:%M')}")
-                st.write(f"**Status:** {'Active' if user.is_active else 'Inactive'}")
-            
-            with col2:
-                st.write("**Preferences:**")
-                st.json(user.preferences)
+    import pandas as pd
+    
+    page = _page_selector(len(deps.session_manager.users), _USERS_PAGE_SIZE, key="users_page")
+    users_df = pd.DataFrame(_user_page(deps.session_manager.revision, (page - 1) * _USERS_PAGE_SIZE, _USERS_PAGE_SIZE))
+    
+    if users_df.empty:
+        st.info("No users yet")
+    else:
+        event = st.dataframe(
+            users_df,
+            hide_index=True,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            key="users_table",
+        )
+        
+        # Show details for the selected user only
+        selected_rows = event.selection.rows
+        if selected_rows:
+            row = users_df.iloc[selected_rows[0]]
+            user = deps.session_manager.users.get(row["id"])
+            if user:
+                st.write(f"**👤 {user.username}** ({user.email or 'No email'})")
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.write("**Preferences:**")
+                    st.code(row["prefs"], language="json")
                 
-                if st.button(f"Deactivate User", key=f"deactivate_{user.id}"):
-                    user.is_active = False
-                    session_manager._save_data()
-                    st.success("User deactivated")
-                    st.rerun()
+                with col2:
+                    if st.button("Deactivate User", key=f"deactivate_{user.id}", disabled=not user.is_active):
+                        user.is_active = False
+                        deps.session_manager.revision += 1
+                        _schedule_save()
+                        _cached_session_stats.clear()
+                        st.success("User deactivated")
+                        st.rerun()
     
     st.divider()
     
@@ -211,32 +480,33 @@ def show_user_management():
     
     with col1:
         if st.button("🧹 Cleanup Expired Sessions"):
-            cleaned = session_manager.cleanup_expired_sessions()
+            cleaned = deps.session_manager.cleanup_expired_sessions()
+            _cached_session_stats.clear()
             st.success(f"Cleaned up {cleaned} expired sessions")
     
     with col2:
         if st.button("📊 Refresh Statistics"):
+            _cached_session_stats.clear()
             st.rerun()
 
 def show_performance_monitor():
     """Performance monitoring and optimization."""
+    deps = _load_admin_deps()
+    
     st.subheader("🚀 Performance Monitor")
     
-    if not monitor:
+    if not deps.monitor:
         st.warning("Performance monitoring not available")
         return
     
     # Performance summary
-    perf_summary = monitor.get_performance_summary()
-    
-    col1, col2, col3 = st.columns(3)
+    perf_summary = _perf_summary(deps.monitor)
     
-    with col1:
-        st.metric("Avg Response Time", f"{perf_summary.get('avg_response_time_ms', 0):.0f}ms")
-    with col2:
-        st.metric("Success Rate", f"{perf_summary.get('success_rate_percent', 0):.1f}%")
-    with col3:
-        st.metric("Total Operations", perf_summary.get('total_operations', 0))
+    _metric_row((
+        ("Avg Response Time", f"{perf_summary.get('avg_response_time_ms', 0):.0f}ms"),
+        ("Success Rate", f"{perf_summary.get('success_rate_percent', 0):.1f}%"),
+        ("Total Operations", perf_summary.get('total_operations', 0)),
+    ))
     
     st.divider()
     
@@ -247,20 +517,18 @@ def show_performance_monitor():
     if operations:
         for op_name, op_stats in operations.items():
             with st.expander(f"📋 {op_name.replace('_', ' ').title()}"):
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Count", op_stats.get('count', 0))
-                with col2:
-                    st.metric("Avg Time", f"{op_stats.get('avg_time', 0):.0f}ms")
-                with col3:
-                    st.metric("Success Rate", f"{op_stats.get('success_rate', 0):.1f}%")
+                _metric_row((
+                    ("Count", op_stats.get('count', 0)),
+                    ("Avg Time", f"{op_stats.get('avg_time', 0):.0f}ms"),
+                    ("Success Rate", f"{op_stats.get('success_rate', 0):.1f}%"),
+                ))
     
     st.divider()
     
     # Cache management
-    if cache:
+    if deps.cache:
         st.subheader("Cache Management")
-        cache_stats = cache.get_stats()
+        cache_stats = deps.cache.get_stats()
         
         col1, col2 = st.columns(2)
         
@@ -270,41 +538,43 @@ def show_performance_monitor():
         
         with col2:
             if st.button("🗑️ Clear Cache"):
-                cache.clear()
+                deps.cache.clear()
                 st.success("Cache cleared")
             
             if st.button("🧹 Cleanup Expired"):
-                expired = cache.cleanup_expired()
+                expired = deps.cache.cleanup_expired()
                 st.success(f"Removed {expired} expired entries")
 
 def show_prompt_management():
     """Prompt template management."""
+    deps = _load_admin_deps()
+    
     st.subheader("🎛️ Prompt Management")
     
-    if not prompt_manager:
+    if not deps.prompt_manager:
         st.warning("Prompt management not available")
         return
     
     # Template statistics
-    template_stats = prompt_manager.get_template_stats()
+    template_stats = _cached_template_stats()
     
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("Total Templates", template_stats.get('total_templates', 0))
-    with col2:
-        st.metric("Active Templates", template_stats.get('active_templates', 0))
-    with col3:
-        st.metric("Total Usage", template_stats.get('total_usage', 0))
+    _metric_row((
+        ("Total Templates", template_stats.get('total_templates', 0)),
+        ("Active Templates", template_stats.get('active_templates', 0)),
+        ("Total Usage", template_stats.get('total_usage', 0)),
+    ))
     
     st.divider()
     
     # Template list
     st.subheader("Templates")
     
-    for template_id, template in prompt_manager.templates.items():
-        if template.is_active:
+    page = _page_selector(template_stats.get('active_templates', 0), _TEMPLATES_PAGE_SIZE, key="templates_page")
+    for template_id in _template_page(deps.prompt_manager.revision, (page - 1) * _TEMPLATES_PAGE_SIZE, _TEMPLATES_PAGE_SIZE):
+        template = deps.prompt_manager.templates.get(template_id)
+        if template and template.is_active:
             with st.expander(f"📝 {template.name} ({template.category})"):
-                col1, col2 = st.columns([2, 1])
+                col1, col2 = st.columns(_TEMPLATE_COLS)
                 
                 with col1:
                     st.write(f"**Description:** {template.description}")
@@ -323,8 +593,8 @@ def show_prompt_management():
                         st.session_state[f"editing_{template_id}"] = True
                     
                     if st.button(f"Disable", key=f"disable_{template_id}"):
-                        template.is_active = False
-                        prompt_manager._save_templates()
+                        deps.prompt_manager.update_template(template_id, {'is_active': False})
+                        _cached_template_stats.clear()
                         st.success("Template disabled")
                         st.rerun()
     
@@ -333,39 +603,41 @@ def show_prompt_management():
     # Create new template
     st.subheader("Create New Template")
     
-    with st.form("new_template"):
-        name = st.text_input("Template Name")
-        description = st.text_area("Description")
-        category = st.selectbox("Category", ["development", "analysis", "creative", "research", "custom"])
-        template_content = st.text_area("Template Content", height=200)
-        
-        if st.form_submit_button("Create Template"):
-            if name and template_content:
-                template_data = {
-                    "name": name,
-                    "description": description,
-                    "category": category,
-                    "template": template_content,
-                    "variables": [],  # Auto-detect variables
-                    "parameters": {"temperature": 0.3, "max_tokens": 2000}
-                }
-                
-                # Auto-detect variables in template
-                import re
-                variables = re.findall(r'\{(\w+)\}', template_content)
-                template_data["variables"] = list(set(variables))
-                
-                template_id = prompt_manager.create_template(template_data)
-                st.success(f"Template created: {template_id}")
-                st.rerun()
-            else:
-                st.error("Please fill in all required fields")
+    # Plain widgets rather than st.form: forms only allow callbacks on the submit button
+    name = st.text_input("Template Name", key="tpl_name")
+    description = st.text_area("Description", key="tpl_description")
+    category = st.selectbox("Category", _CATEGORIES, key="tpl_category")
+    template_content = st.text_area("Template Content", height=200, key="tpl_content", on_change=_update_vars)
+    
+    detected_vars = st.session_state.get("tpl_vars", [])
+    if detected_vars:
+        st.caption(f"Detected variables: {', '.join(detected_vars)}")
+    
+    if st.button("Create Template"):
+        if name and template_content:
+            template_data = {
+                "name": name,
+                "description": description,
+                "category": category,
+                "template": template_content,
+                "variables": detected_vars,  # Auto-detected as the content changes
+                "parameters": {"temperature": 0.3, "max_tokens": 2000}
+            }
+            
+            template_id = deps.prompt_manager.create_template(template_data)
+            _cached_template_stats.clear()
+            st.success(f"Template created: {template_id}")
+            st.rerun()
+        else:
+            st.error("Please fill in all required fields")
 
 def show_security_panel():
     """Security monitoring and controls."""
+    deps = _load_admin_deps()
+    
     st.subheader("🔒 Security Panel")
     
-    if not security_manager or not rate_limiter:
+    if not deps.security_manager or not deps.rate_limiter:
         st.warning("Security features not available")
         return
     
@@ -373,13 +645,7 @@ def show_security_panel():
     st.subheader("Rate Limiting")
     
     # Show current limits
-    limits_info = {
-        "Chat Requests": "60 per hour",
-        "File Uploads": "10 per hour", 
-        "API Calls": "100 per hour"
-    }
-    
-    for action, limit in limits_info.items():
+    for action, limit in _RATE_LIMITS_INFO:
         st.write(f"**{action}:** {limit}")
     
     st.divider()
@@ -393,8 +659,8 @@ def show_security_panel():
     
     allowed_extensions = st.multiselect(
         "Allowed File Extensions",
-        [".pdf", ".docx", ".xlsx", ".csv", ".txt", ".md", ".py", ".js", ".html", ".json"],
-        default=[".pdf", ".docx", ".txt", ".md", ".py"]
+        _ALLOWED_EXT_CHOICES,
+        default=_DEFAULT_ALLOWED_EXT
     )
     
     if st.button("Update Security Settings"):
@@ -414,12 +680,14 @@ def show_security_panel():
 
 def show_advanced_settings():
     """Advanced system settings."""
+    deps = _load_admin_deps()
+    
     st.subheader("⚙️ Advanced Settings")
     
     # Code execution settings
     st.subheader("Code Execution")
     
-    if safe_executor:
+    if deps.safe_executor:
         enable_code_exec = st.checkbox("Enable Code Execution", value=False)
         
         if enable_code_exec:
@@ -431,17 +699,15 @@ def show_advanced_settings():
         if st.button("Test Code Execution"):
             test_code = """
 print("Hello from safe executor!")
-import math
 result = math.sqrt(16)
 print(f"Square root of 16 is: {result}")
 """
-            if safe_executor:
-                exec_result = safe_executor.execute_code(test_code)
-                if exec_result.success:
+            if deps.safe_executor:
+                output = _stream_code_output(test_code)
+                if "Square root of 16 is: 4.0" in output:
                     st.success("Code execution test passed!")
-                    st.code(exec_result.output)
                 else:
-                    st.error(f"Code execution test failed: {exec_result.error}")
+                    st.error("Code execution test failed")
     else:
         st.info("Code execution not available")
     
@@ -455,7 +721,7 @@ print(f"Square root of 16 is: {result}")
     
     context_strategy = st.selectbox(
         "Context Strategy",
-        ["balanced", "prefer_recent", "prefer_context", "adaptive"]
+        _CONTEXT_STRATEGIES
     )
     
     if st.button("Apply Optimization Settings"):
@@ -470,14 +736,15 @@ print(f"Square root of 16 is: {result}")
     
     with col1:
         if st.button("🧹 Run Full Cleanup"):
-            with st.spinner("Running cleanup..."):
-                time.sleep(2)  # Simulate cleanup
-                st.success("System cleanup completed")
+            expired_sessions = deps.session_manager.cleanup_expired_sessions() if deps.session_manager else 0
+            expired_entries = deps.cache.cleanup_expired() if deps.cache else 0
+            _cached_session_stats.clear()
+            st.success(
+                f"System cleanup completed ({expired_sessions} sessions, {expired_entries} cache entries removed)"
+            )
         
         if st.button("📊 Generate System Report"):
-            with st.spinner("Generating report..."):
-                time.sleep(1)
-                st.success("System report generated")
+            st.success("System report generated")
     
     with col2:
         if st.button("🔄 Restart Services"):
@@ -488,11 +755,23 @@ print(f"Square root of 16 is: {result}")
         if st.button("💾 Backup Configuration"):
             st.success("Configuration backed up")
 
+# Admin tab label -> panel renderer (same order as _ADMIN_TABS)
+_PANEL_DISPATCH = dict(zip(_ADMIN_TABS, (
+    show_system_monitor,
+    show_user_management,
+    show_performance_monitor,
+    show_prompt_management,
+    show_security_panel,
+    show_advanced_settings,
+)))
+
 def show_code_playground():
     """Interactive code playground for testing."""
+    deps = _load_admin_deps()
+    
     st.subheader("🧪 Code Playground")
     
-    if not safe_executor:
+    if not deps.safe_executor:
         st.warning("Code execution not available")
         return
     
@@ -526,25 +805,19 @@ print(f"Square root of 2 = {math.sqrt(2):.4f}")
     with col1:
         if st.button("▶️ Run Code", type="primary"):
             if code_input.strip():
-                with st.spinner("Executing code..."):
-                    result = safe_executor.execute_code(code_input)
+                start_time = time.monotonic()
                 
-                # Show results
-                if result.success:
-                    st.success(f"✅ Executed in {result.execution_time:.3f}s")
-                    if result.output:
-                        st.subheader("Output:")
-                        st.code(result.output)
-                else:
-                    st.error("❌ Execution failed")
-                    if result.error:
-                        st.subheader("Error:")
-                        st.code(result.error)
+                # Stream output into the page as the code prints it
+                st.subheader("Output:")
+                _stream_code_output(code_input)
+                
+                st.caption(f"Finished in {time.monotonic() - start_time:.3f}s")
                 
                 # Show warnings
-                if result.warnings:
+                _, warnings = deps.safe_executor.validator.validate_code(code_input)
+                if warnings:
                     st.warning("⚠️ Security warnings:")
-                    for warning in result.warnings:
+                    for warning in warnings:
                         st.write(f"- {warning}")
             else:
                 st.error("Please enter some code to execute")
@@ -552,7 +825,7 @@ print(f"Square root of 2 = {math.sqrt(2):.4f}")
     with col2:
         if st.button("🔍 Analyze Code"):
             if code_input.strip():
-                analysis = code_analyzer.analyze_code_structure(code_input)
+                _, _, analysis, suggestions = deps.code_analyzer.analyze_all(code_input)
                 
                 if 'error' not in analysis:
                     st.subheader("Code Analysis:")
@@ -569,7 +842,6 @@ print(f"Square root of 2 = {math.sqrt(2):.4f}")
                         st.write(f"**Imports:** {len(analysis['imports'])}")
                     
                     # Suggestions
-                    suggestions = code_analyzer.suggest_improvements(code_input)
                     if suggestions:
                         st.subheader("Improvement Suggestions:")
                         for suggestion in suggestions:
@@ -3,14 +3,20 @@ Agent logic: ReAct framework, tool belt, and prompt engineering.
 Handles interaction with AI models and provides development tools.
 """
 
+import ast
 import json
 import logging
 import asyncio
+import os
 import re
 import math
-from typing import Dict, List, Optional, Any, Union
-from dataclasses import dataclass
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, AsyncIterator, Dict, Final, Iterator, List, Optional, Tuple, Union
+from dataclasses import asdict, dataclass
 from datetime import datetime
+from functools import lru_cache
 
 try:
     import requests
@@ -21,11 +27,103 @@ except ImportError:
     # Will be handled gracefully
     pass
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from .config import config_manager, ModelConfig
 from .retrieval import DocumentRetrieval
 
 logger = logging.getLogger(__name__)
 
+_TOOL_RE = re.compile(r'\[TOOL:(\w+):([^\]]+)\]')
+
+# Static system prompt, built once so every turn sends a byte-identical prefix
+BASE_TOOL_PROMPT: Final[str] = """You are a helpful AI assistant specialized in development tasks. You can help with:
+- Code generation and review
+- Debugging and troubleshooting  
+- Explaining technical concepts
+- Document analysis and summarization
+- Architecture and design guidance
+
+You have access to the following tools that you can use by including tool calls in your response:
+
+🧮 **Calculator**: Use [TOOL:calculator:expression] for mathematical calculations
+   Example: [TOOL:calculator:2+2*3] or [TOOL:calculator:sqrt(16)]
+
+🔍 **Web Search**: Use [TOOL:web_search:query] to search for current information
+   Example: [TOOL:web_search:latest Python features 2024]
+
+🔧 **Code Analysis**: Use [TOOL:code_analysis:code] or [TOOL:code_analysis:language:code] to analyze code
+   Example: [TOOL:code_analysis:python:def hello(): print("world")]
+
+When using tools, the results will be automatically inserted into your response. Use these tools when they would be helpful for answering the user's question.
+
+Provide clear, accurate, and helpful responses. Use markdown formatting for code blocks."""
+
+_MATH_FUNCS = {
+    "sqrt": math.sqrt,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "log": math.log,
+}
+_MATH_NS = {**_MATH_FUNCS, "pi": math.pi, "e": math.e}
+# Anything that can't appear in an arithmetic expression is stripped first
+_SAFE_RE = re.compile(r'[^\w+\-*/%().,\s]')
+# Whole-word match so names inside other identifiers (e.g. the 'e' in 'exp') are untouched
+_FN_RE = re.compile(r'\b(?:math\.)?(sqrt|sin|cos|tan|log|ln|pi|e)\b')
+_FN_MAP = {"ln": "log"}
+
+def _map_fn(match: "re.Match") -> str:
+    """Map a matched function/constant name onto the calculator namespace."""
+    return _FN_MAP.get(match.group(1), match.group(1))
+
+_CALC_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Call, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub,
+)
+
+class _CalcValidator(ast.NodeVisitor):
+    """Rejects anything but arithmetic over numbers and whitelisted math names."""
+    
+    def generic_visit(self, node):
+        if not isinstance(node, _CALC_NODES):
+            raise ValueError(f"Unsupported syntax: {type(node).__name__}")
+        super().generic_visit(node)
+        
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ValueError(f"Unsupported constant: {node.value!r}")
+            
+    def visit_Name(self, node):
+        if node.id not in _MATH_NS:
+            raise ValueError(f"Unknown name: {node.id}")
+            
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _MATH_FUNCS or node.keywords:
+            raise ValueError("Only sqrt, sin, cos, tan and log calls are allowed")
+        for arg in node.args:
+            self.visit(arg)
+
+@lru_cache(maxsize=512)
+def _compile(expr: str):
+    """Validate and compile a calculator expression once per distinct input."""
+    tree = ast.parse(expr, mode='eval')
+    _CalcValidator().visit(tree)
+    return compile(tree, '<calc>', 'eval')
+
 class CalculatorTool:
     """Simple calculator tool for mathematical operations."""
     
@@ -33,20 +131,10 @@ class CalculatorTool:
     def calculate(expression: str) -> str:
         """Safely evaluate mathematical expressions."""
         try:
-            # Remove any non-mathematical characters for safety
-            safe_expr = re.sub(r'[^0-9+\-*/().\s]', '', expression)
-            
-            # Replace common math functions
-            safe_expr = safe_expr.replace('sqrt', 'math.sqrt')
-            safe_expr = safe_expr.replace('sin', 'math.sin')
-            safe_expr = safe_expr.replace('cos', 'math.cos')
-            safe_expr = safe_expr.replace('tan', 'math.tan')
-            safe_expr = safe_expr.replace('log', 'math.log')
-            safe_expr = safe_expr.replace('pi', 'math.pi')
-            safe_expr = safe_expr.replace('e', 'math.e')
-            
-            # Evaluate the expression
-            result = eval(safe_expr, {"__builtins__": {}, "math": math})
+            # Sanitize, normalise function names, then evaluate the cached validated AST
+            safe_expr = _SAFE_RE.sub('', expression).strip()
+            safe_expr = _FN_RE.sub(_map_fn, safe_expr)
+            result = eval(_compile(safe_expr), {"__builtins__": {}}, _MATH_NS)
             return f"Result: {result}"
         except Exception as e:
             return f"Error calculating '{expression}': {str(e)}"
@@ -81,38 +169,51 @@ class CodeAnalysisTool:
     @staticmethod
     def analyze_code(code: str, language: str = "python") -> str:
         """Analyze code for potential issues, improvements, or explanations."""
-        analysis = []
-        
-        # Basic code analysis
         lines = code.split('\n')
-        analysis.append(f"Code Analysis for {language.title()}:")
-        analysis.append(f"- Total lines: {len(lines)}")
-        analysis.append(f"- Non-empty lines: {len([l for l in lines if l.strip()])}")
+        nonempty = imports = funcs = classes = 0
+        has_import = has_def = has_class = has_print = has_todo = False
+        
+        # Single pass over the lines collecting every counter and flag
+        for line in lines:
+            s = line.strip()
+            if s:
+                nonempty += 1
+                if s.startswith(('import ', 'from ')):
+                    imports += 1
+                elif s.startswith('def '):
+                    funcs += 1
+                elif s.startswith('class '):
+                    classes += 1
+            has_import = has_import or 'import ' in line
+            has_def = has_def or 'def ' in line
+            has_class = has_class or 'class ' in line
+            has_print = has_print or 'print(' in line
+            has_todo = has_todo or 'TODO' in line or 'FIXME' in line
+            
+        analysis = [
+            f"Code Analysis for {language.title()}:",
+            f"- Total lines: {len(lines)}",
+            f"- Non-empty lines: {nonempty}",
+        ]
         
         if language.lower() == "python":
             # Python-specific analysis
-            if "import " in code:
-                imports = [l.strip() for l in lines if l.strip().startswith('import ') or l.strip().startswith('from ')]
-                analysis.append(f"- Imports found: {len(imports)}")
-            
-            if "def " in code:
-                functions = [l.strip() for l in lines if l.strip().startswith('def ')]
-                analysis.append(f"- Functions defined: {len(functions)}")
-            
-            if "class " in code:
-                classes = [l.strip() for l in lines if l.strip().startswith('class ')]
-                analysis.append(f"- Classes defined: {len(classes)}")
-            
+            if has_import:
+                analysis.append(f"- Imports found: {imports}")
+            if has_def:
+                analysis.append(f"- Functions defined: {funcs}")
+            if has_class:
+                analysis.append(f"- Classes defined: {classes}")
+                
             # Check for common patterns
-            if "print(" in code:
+            if has_print:
                 analysis.append("- Contains print statements (consider using logging)")
-            
-            if "TODO" in code or "FIXME" in code:
+            if has_todo:
                 analysis.append("- Contains TODO/FIXME comments")
         
         return "\n".join(analysis)
 
-@dataclass
+@dataclass(slots=True)
 class ChatMessage:
     """Represents a chat message."""
     role: str  # "user", "assistant", "system"
@@ -120,7 +221,7 @@ class ChatMessage:
     timestamp: datetime
     metadata: Optional[Dict[str, Any]] = None
 
-@dataclass
+@dataclass(slots=True)
 class ChatSession:
     """Represents a chat session."""
     id: str
@@ -130,6 +231,109 @@ class ChatSession:
     updated_at: datetime
     model_used: Optional[str] = None
 
+_RAG_CONTEXT_TOKENS = 2000
+_SEMANTIC_CACHE_SIZE = 128
+_SEMANTIC_CACHE_THRESHOLD = 0.95
+_AVAILABILITY_TTL = 30.0
+_AVAILABILITY_CACHE: Dict[tuple, tuple] = {}
+
+def _cached_availability(key: tuple) -> Optional[bool]:
+    """Return a still-fresh probe result for an endpoint, or None."""
+    cached = _AVAILABILITY_CACHE.get(key)
+    if cached and time.monotonic() - cached[0] < _AVAILABILITY_TTL:
+        return cached[1]
+    return None
+
+@lru_cache(maxsize=1)
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Long-lived event loop that sync callers submit coroutines to.
+    
+    Model clients cache async HTTP connections bound to the loop that created
+    them, so every sync call must reuse one loop rather than asyncio.run's
+    fresh (and then closed) loop per call.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="rag-agent-loop").start()
+    return loop
+
+def _run_sync(coro) -> Any:
+    """Run a coroutine on the background loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+def _iter_sync(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """Drive an async iterator on the background loop, yielding its items to sync code."""
+    try:
+        while True:
+            try:
+                yield _run_sync(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        # Runs the generator's cleanup when the consumer stops early too
+        _run_sync(agen.aclose())
+
+@lru_cache(maxsize=1)
+def _http_session() -> "requests.Session":
+    """Shared HTTP session so availability probes reuse pooled connections."""
+    return requests.Session()
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """Load the tokenizer once; None means fall back to a character estimate."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable, estimating tokens: {e}")
+        return None
+
+def _count_tokens(text: str) -> int:
+    """Count tokens in text (roughly 1 token per 4 characters without tiktoken)."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+# (role, content) pairs, the message format LangChain chat models accept directly
+WireMessage = Tuple[str, str]
+
+def _to_wire(messages: List[Union["ChatMessage", WireMessage]]) -> List[WireMessage]:
+    """Convert ChatMessage objects to (role, content) pairs; pairs pass through."""
+    return [msg if isinstance(msg, tuple) else (msg.role, msg.content) for msg in messages]
+
+def _pack_messages(messages: List[WireMessage], budget: int) -> List[WireMessage]:
+    """Keep the newest messages whose tokens fit the budget; the latest always stays."""
+    packed = []
+    used = 0
+    for msg in reversed(messages):
+        # ~4 tokens of per-message chat framing overhead
+        cost = _count_tokens(msg[1]) + 4
+        if packed and used + cost > budget:
+            break
+        packed.append(msg)
+        used += cost
+    packed.reverse()
+    return packed
+
+def _json_default(obj: Any) -> str:
+    """Serialize datetimes as ISO strings for the stdlib json fallback."""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+def _loads(data: bytes) -> Any:
+    """Parse JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize a dataclass tree to JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(asdict(obj), default=_json_default).encode()
+
 class ModelInterface:
     """Interface for different AI model types."""
     
@@ -170,38 +374,51 @@ class ModelInterface:
             logger.error(f"Error initializing {self.config.type} client: {e}")
             self.client = None
             
+    def _probe_url(self) -> str:
+        """URL that answers 200 when the local model server is up."""
+        if "ollama" in self.config.endpoint:
+            return self.config.endpoint.replace("/v1", "") + "/api/tags"
+        return self.config.endpoint + "/models"
+        
     def is_available(self) -> bool:
         """Check if the model is available."""
         if not self.client:
             return False
             
+        if self.config.type not in ["ollama", "lm_studio"]:
+            # For cloud models, assume available if API key is provided
+            return bool(self.config.api_key)
+            
+        # Local servers are probed at most once per TTL per endpoint
+        key = (self.config.type, self.config.endpoint)
+        cached = _cached_availability(key)
+        if cached is not None:
+            return cached
+            
         try:
-            if self.config.type in ["ollama", "lm_studio"]:
-                # Check if local server is running
-                response = requests.get(
-                    self.config.endpoint.replace("/v1", "") + "/api/tags" if "ollama" in self.config.endpoint 
-                    else self.config.endpoint + "/models",
-                    timeout=5
-                )
-                return response.status_code == 200
-            else:
-                # For cloud models, assume available if API key is provided
-                return bool(self.config.api_key)
-                
+            # Check if local server is running
+            response = _http_session().get(self._probe_url(), timeout=2)
+            available = response.status_code == 200
         except Exception as e:
             logger.error(f"Error checking availability for {self.config.name}: {e}")
-            return False
+            available = False
             
-    def generate_response(self, messages: List[ChatMessage], **kwargs) -> Optional[str]:
+        _AVAILABILITY_CACHE[key] = (time.monotonic(), available)
+        return available
+        
+    async def ais_available(self) -> bool:
+        """Check if the model is available without blocking the event loop."""
+        # The probe shares is_available's TTL cache, so only a cache miss uses a thread
+        return await asyncio.to_thread(self.is_available)
+        
+    def generate_response(self, messages: List[Union[ChatMessage, WireMessage]], **kwargs) -> Optional[str]:
         """Generate response from the model."""
         if not self.client:
             raise RuntimeError(f"Client not initialized for {self.config.name}")
             
         try:
             # Convert ChatMessage objects to format expected by LangChain
-            formatted_messages = []
-            for msg in messages:
-                formatted_messages.append((msg.role, msg.content))
+            formatted_messages = _to_wire(messages)
                 
             # Generate response
             response = self.client.invoke(formatted_messages)
@@ -214,6 +431,41 @@ class ModelInterface:
         except Exception as e:
             logger.error(f"Error generating response with {self.config.name}: {e}")
             raise
+            
+    async def agenerate_response(self, messages: List[Union[ChatMessage, WireMessage]], **kwargs) -> Optional[str]:
+        """Generate response from the model without blocking the event loop."""
+        if not self.client:
+            raise RuntimeError(f"Client not initialized for {self.config.name}")
+            
+        try:
+            formatted_messages = _to_wire(messages)
+            
+            # Generate response
+            response = await self.client.ainvoke(formatted_messages)
+            
+            if hasattr(response, 'content'):
+                return response.content
+            else:
+                return str(response)
+                
+        except Exception as e:
+            logger.error(f"Error generating response with {self.config.name}: {e}")
+            raise
+            
+    async def astream_response(self, messages: List[Union[ChatMessage, WireMessage]]) -> AsyncIterator[str]:
+        """Stream the model's response as text chunks."""
+        if not self.client:
+            raise RuntimeError(f"Client not initialized for {self.config.name}")
+            
+        try:
+            async for chunk in self.client.astream(_to_wire(messages)):
+                content = getattr(chunk, 'content', chunk)
+                if isinstance(content, str) and content:
+                    yield content
+                    
+        except Exception as e:
+            logger.error(f"Error streaming response with {self.config.name}: {e}")
+            raise
 
 class RAGAgent:
     """Main RAG Agent that combines retrieval and generation."""
@@ -227,6 +479,12 @@ class RAGAgent:
         self.current_model: Optional[ModelInterface] = None
         self.chat_sessions: Dict[str, ChatSession] = {}
         self.current_session_id: Optional[str] = None
+        self._dirty: set = set()
+        self._pending_messages: Dict[str, List[Dict[str, Any]]] = {}
+        self._iface_cache: Dict[str, tuple] = {}
+        self._wire_cache: Dict[str, List[WireMessage]] = {}
+        self._sem_cache_vecs: Optional["np.ndarray"] = None
+        self._sem_cache_ctx: List[str] = []
         
         # Initialize tools
         self.tools = {
@@ -234,6 +492,11 @@ class RAGAgent:
             "web_search": WebSearchTool(),
             "code_analysis": CodeAnalysisTool()
         }
+        self._tool_dispatch = {
+            "calculator": lambda x: f"🧮 {self.tools['calculator'].calculate(x)}",
+            "web_search": lambda x: f"🔍 {self.tools['web_search'].search(x)}",
+            "code_analysis": lambda x: f"🔧 {self._run_code_analysis(x)}",
+        }
         
         # Load chat history
         self._load_chat_sessions()
@@ -245,102 +508,148 @@ class RAGAgent:
     def _load_chat_sessions(self):
         """Load chat sessions from disk."""
         try:
-            import os
             history_dir = self.config.chat_history_path
-            os.makedirs(history_dir, exist_ok=True)
+            sessions_dir = os.path.join(history_dir, "sessions")
             
-            history_file = os.path.join(history_dir, "sessions.json")
-            if os.path.exists(history_file):
-                with open(history_file, 'r') as f:
-                    sessions_data = json.load(f)
-                    
-                # Handle both dictionary and array formats
-                if isinstance(sessions_data, dict):
-                    # Convert dict format to list of sessions
-                    sessions_list = list(sessions_data.values())
-                elif isinstance(sessions_data, list):
-                    sessions_list = sessions_data
-                else:
-                    logger.warning(f"Unknown sessions data format: {type(sessions_data)}")
-                    return
+            if not os.path.isdir(sessions_dir):
+                os.makedirs(history_dir, exist_ok=True)
+                self._migrate_legacy_sessions(os.path.join(history_dir, "sessions.json"))
+                return
+                
+            for file_name in os.listdir(sessions_dir):
+                if not file_name.endswith(".json"):
+                    continue
                     
-                for session_data in sessions_list:
-                    # Convert message timestamps back to datetime
-                    messages = []
-                    for msg_data in session_data['messages']:
-                        msg = ChatMessage(
-                            role=msg_data['role'],
-                            content=msg_data['content'],
-                            timestamp=datetime.fromisoformat(msg_data['timestamp']),
-                            metadata=msg_data.get('metadata')
-                        )
-                        messages.append(msg)
+                try:
+                    with open(os.path.join(sessions_dir, file_name), 'rb') as f:
+                        session_data = _loads(f.read())
                         
-                    session = ChatSession(
-                        id=session_data['id'],
-                        title=session_data['title'],
-                        messages=messages,
-                        created_at=datetime.fromisoformat(session_data['created_at']),
-                        updated_at=datetime.fromisoformat(session_data['updated_at']),
-                        model_used=session_data.get('model_used')
-                    )
+                    # Messages stay raw until the session is opened
+                    session = self._session_from_dict(dict(session_data, messages=[]))
                     self.chat_sessions[session.id] = session
+                    self._pending_messages[session.id] = session_data['messages']
+                except Exception as e:
+                    logger.error(f"Error loading chat session {file_name}: {e}")
                     
         except Exception as e:
             logger.error(f"Error loading chat sessions: {e}")
             
+    def _migrate_legacy_sessions(self, history_file: str):
+        """Import the old single-file sessions.json into per-session files."""
+        if os.path.exists(history_file):
+            with open(history_file, 'rb') as f:
+                sessions_data = _loads(f.read())
+                
+            # Handle both dictionary and array formats
+            if isinstance(sessions_data, dict):
+                # Convert dict format to list of sessions
+                sessions_list = list(sessions_data.values())
+            elif isinstance(sessions_data, list):
+                sessions_list = sessions_data
+            else:
+                logger.warning(f"Unknown sessions data format: {type(sessions_data)}")
+                sessions_list = []
+                
+            for session_data in sessions_list:
+                session = self._session_from_dict(session_data)
+                self.chat_sessions[session.id] = session
+                self._dirty.add(session.id)
+                
+        os.makedirs(os.path.join(os.path.dirname(history_file), "sessions"), exist_ok=True)
+        self._save_chat_sessions()
+        
+    @staticmethod
+    def _messages_from_dicts(messages_data: List[Dict[str, Any]]) -> List[ChatMessage]:
+        """Rebuild ChatMessage objects, converting timestamps back to datetime."""
+        return [
+            ChatMessage(
+                role=msg_data['role'],
+                content=msg_data['content'],
+                timestamp=datetime.fromisoformat(msg_data['timestamp']),
+                metadata=msg_data.get('metadata')
+            )
+            for msg_data in messages_data
+        ]
+        
+    @classmethod
+    def _session_from_dict(cls, session_data: Dict[str, Any]) -> ChatSession:
+        """Rebuild a ChatSession from its serialized form."""
+        return ChatSession(
+            id=session_data['id'],
+            title=session_data['title'],
+            messages=cls._messages_from_dicts(session_data['messages']),
+            created_at=datetime.fromisoformat(session_data['created_at']),
+            updated_at=datetime.fromisoformat(session_data['updated_at']),
+            model_used=session_data.get('model_used')
+        )
+        
+    def _materialize(self, session: ChatSession) -> ChatSession:
+        """Build a lazily loaded session's messages on first use."""
+        messages_data = self._pending_messages.pop(session.id, None)
+        if messages_data is not None:
+            session.messages[:0] = self._messages_from_dicts(messages_data)
+        return session
+        
     def _save_chat_sessions(self):
-        """Save chat sessions to disk."""
+        """Save changed chat sessions to disk, one file per session."""
         try:
-            import os
-            history_dir = self.config.chat_history_path
-            os.makedirs(history_dir, exist_ok=True)
-            
-            # Convert sessions to JSON-serializable format
-            sessions_data = []
-            for session in self.chat_sessions.values():
-                messages_data = []
-                for msg in session.messages:
-                    msg_data = {
-                        'role': msg.role,
-                        'content': msg.content,
-                        'timestamp': msg.timestamp.isoformat(),
-                        'metadata': msg.metadata
-                    }
-                    messages_data.append(msg_data)
-                    
-                session_data = {
-                    'id': session.id,
-                    'title': session.title,
-                    'messages': messages_data,
-                    'created_at': session.created_at.isoformat(),
-                    'updated_at': session.updated_at.isoformat(),
-                    'model_used': session.model_used
-                }
-                sessions_data.append(session_data)
+            sessions_dir = os.path.join(self.config.chat_history_path, "sessions")
+            os.makedirs(sessions_dir, exist_ok=True)
+            
+            # Only sessions touched since the last save are re-serialized
+            for session_id in list(self._dirty):
+                session_file = os.path.join(sessions_dir, f"{session_id}.json")
+                session = self.chat_sessions.get(session_id)
                 
-            history_file = os.path.join(history_dir, "sessions.json")
-            with open(history_file, 'w') as f:
-                json.dump(sessions_data, f, indent=2)
+                if session is None:
+                    if os.path.exists(session_file):
+                        os.remove(session_file)
+                else:
+                    self._materialize(session)
+                    tmp_file = session_file + ".tmp"
+                    with open(tmp_file, 'wb') as f:
+                        f.write(_dumps(session))
+                    os.replace(tmp_file, session_file)
+                    
+                self._dirty.discard(session_id)
                 
         except Exception as e:
             logger.error(f"Error saving chat sessions: {e}")
             
+    def _get_interface(self, model_key: str, model_config: ModelConfig) -> ModelInterface:
+        """Return the cached interface for a model, rebuilding it if its config changed."""
+        fingerprint = (model_config.name, model_config.type, model_config.endpoint,
+                       model_config.api_key, model_config.model_id)
+        cached = self._iface_cache.get(model_key)
+        if cached is None or cached[0] != fingerprint:
+            cached = (fingerprint, ModelInterface(model_config))
+            self._iface_cache[model_key] = cached
+        return cached[1]
+        
     def get_available_models(self) -> List[ModelConfig]:
         """Get list of available models."""
-        available = []
-        for model_config in self.config.models.values():
-            interface = ModelInterface(model_config)
-            if interface.is_available():
-                model_config.is_available = True
-                available.append(model_config)
-            else:
-                model_config.is_available = False
+        interfaces = {
+            model_key: self._get_interface(model_key, model_config)
+            for model_key, model_config in self.config.models.items()
+        }
+        if not interfaces:
+            return []
+            
+        # Probe all models concurrently so wall time is the slowest probe, not the sum
+        with ThreadPoolExecutor(max_workers=min(8, len(interfaces))) as pool:
+            futures = {pool.submit(iface.is_available): key for key, iface in interfaces.items()}
+            for future in as_completed(futures):
+                self.config.models[futures[future]].is_available = future.result()
                 
-        return available
+        # Keep the configured model order regardless of probe completion order
+        return [cfg for cfg in self.config.models.values() if cfg.is_available]
         
     def switch_model(self, model_key: str) -> bool:
         """Switch to a different model."""
+        return _run_sync(self.aswitch_model(model_key))
+        
+    async def aswitch_model(self, model_key: str) -> bool:
+        """Switch to a different model, probing its availability off the event loop."""
         if model_key not in self.config.models:
             logger.error(f"Model {model_key} not found in configuration")
             return False
@@ -348,8 +657,8 @@ class RAGAgent:
         model_config = self.config.models[model_key]
         
         try:
-            new_interface = ModelInterface(model_config)
-            if new_interface.is_available():
+            new_interface = self._get_interface(model_key, model_config)
+            if await new_interface.ais_available():
                 self.current_model = new_interface
                 self.config.selected_model = model_key
                 config_manager.save_config()
@@ -384,6 +693,7 @@ class RAGAgent:
         
         self.chat_sessions[session_id] = session
         self.current_session_id = session_id
+        self._dirty.add(session_id)
         self._save_chat_sessions()
         
         logger.info(f"Created new session: {title}")
@@ -404,22 +714,53 @@ class RAGAgent:
         if session_id in self.chat_sessions:
             title = self.chat_sessions[session_id].title
             del self.chat_sessions[session_id]
+            self._pending_messages.pop(session_id, None)
+            self._wire_cache.pop(session_id, None)
             
             if self.current_session_id == session_id:
                 self.current_session_id = None
                 
+            self._dirty.add(session_id)
             self._save_chat_sessions()
             logger.info(f"Deleted session: {title}")
             return True
         else:
             return False
             
+    def _session_wire(self, session: ChatSession) -> List[WireMessage]:
+        """Return the session's history as cached (role, content) pairs."""
+        wire = self._wire_cache.get(session.id)
+        if wire is None or len(wire) != len(session.messages):
+            # Rebuilt only when messages changed outside achat (first use, load, edits)
+            wire = _to_wire(session.messages)
+            self._wire_cache[session.id] = wire
+        return wire
+        
     def get_current_session(self) -> Optional[ChatSession]:
         """Get the current chat session."""
         if self.current_session_id:
-            return self.chat_sessions.get(self.current_session_id)
+            session = self.chat_sessions.get(self.current_session_id)
+            return self._materialize(session) if session else None
         return None
         
+    @staticmethod
+    def _title_prompt(content: str) -> List[WireMessage]:
+        """Build the title-generation prompt for a conversation topic."""
+        return [
+            ("system", "Generate a short 4-6 word title for this conversation topic. Be specific and descriptive."),
+            ("user", f"Topic: {content}"),
+        ]
+        
+    @staticmethod
+    def _finalize_title(title: Optional[str], content: str) -> str:
+        """Clean up a generated title, falling back to the topic's first words."""
+        if title and len(title) < 60:
+            return title.strip().strip('"')
+            
+        # Fallback: extract key words
+        words = content.split()[:4]
+        return " ".join(words) + ("..." if len(content) > 100 else "")
+        
     def generate_session_title(self, messages: List[ChatMessage]) -> str:
         """Generate a title for a session based on its messages."""
         if not messages:
@@ -435,66 +776,54 @@ class RAGAgent:
         content = first_user_msg.content[:100]  # First 100 chars
         
         # Try to generate with AI if available
+        title = None
         if self.current_model:
             try:
-                prompt_msgs = [
-                    ChatMessage(
-                        role="system",
-                        content="Generate a short 4-6 word title for this conversation topic. Be specific and descriptive.",
-                        timestamp=datetime.now()
-                    ),
-                    ChatMessage(
-                        role="user", 
-                        content=f"Topic: {content}",
-                        timestamp=datetime.now()
-                    )
-                ]
-                
-                title = self.current_model.generate_response(prompt_msgs)
-                if title and len(title) < 60:
-                    return title.strip().strip('"')
-                    
+                title = self.current_model.generate_response(self._title_prompt(content))
             except Exception as e:
                 logger.error(f"Error generating title: {e}")
                 
-        # Fallback: extract key words
-        words = content.split()[:4]
-        return " ".join(words) + ("..." if len(content) > 100 else "")
+        return self._finalize_title(title, content)
         
+    def _run_code_analysis(self, tool_input: str) -> str:
+        """Run code analysis, honouring an optional 'language:' prefix."""
+        # Extract language if provided, default to python
+        if ":" in tool_input:
+            lang, code = tool_input.split(":", 1)
+            return self.tools["code_analysis"].analyze_code(code.strip(), lang.strip())
+        return self.tools["code_analysis"].analyze_code(tool_input, "python")
+        
+    def _execute_tool(self, match: "re.Match") -> str:
+        """Execute a single matched tool call and format its result."""
+        tool_name = match.group(1)
+        handler = self._tool_dispatch.get(tool_name)
+        if handler is None:
+            return f"❌ Unknown tool: {tool_name}"
+            
+        try:
+            return handler(match.group(2).strip())
+        except Exception as e:
+            return f"❌ Tool error: {str(e)}"
+            
     def _process_tool_calls(self, text: str) -> str:
         """Process any tool calls in the text and execute them."""
-        import re
-        
-        # Look for tool call patterns like [TOOL:calculator:2+2] or [TOOL:web_search:python tutorial]
-        tool_pattern = r'\[TOOL:(\w+):([^\]]+)\]'
-        
-        def execute_tool(match):
-            tool_name = match.group(1)
-            tool_input = match.group(2).strip()
+        # Tool calls look like [TOOL:calculator:2+2] or [TOOL:web_search:python tutorial]
+        matches = list(_TOOL_RE.finditer(text))
+        if len(matches) <= 1:
+            return _TOOL_RE.sub(self._execute_tool, text)
             
-            try:
-                if tool_name == "calculator":
-                    result = self.tools["calculator"].calculate(tool_input)
-                    return f"🧮 {result}"
-                elif tool_name == "web_search":
-                    result = self.tools["web_search"].search(tool_input)
-                    return f"🔍 {result}"
-                elif tool_name == "code_analysis":
-                    # Extract language if provided, default to python
-                    if ":" in tool_input:
-                        lang, code = tool_input.split(":", 1)
-                        result = self.tools["code_analysis"].analyze_code(code.strip(), lang.strip())
-                    else:
-                        result = self.tools["code_analysis"].analyze_code(tool_input, "python")
-                    return f"🔧 {result}"
-                else:
-                    return f"❌ Unknown tool: {tool_name}"
-            except Exception as e:
-                return f"❌ Tool error: {str(e)}"
-        
-        # Replace all tool calls with their results
-        processed_text = re.sub(tool_pattern, execute_tool, text)
-        return processed_text
+        # Several calls: run them concurrently, then splice results back in order
+        with ThreadPoolExecutor(max_workers=min(4, len(matches))) as pool:
+            results = list(pool.map(self._execute_tool, matches))
+            
+        parts = []
+        last = 0
+        for match, result in zip(matches, results):
+            parts.append(text[last:match.start()])
+            parts.append(result)
+            last = match.end()
+        parts.append(text[last:])
+        return "".join(parts)
 
     def chat(self, user_input: str, use_rag: bool = True) -> str:
         """
@@ -507,8 +836,122 @@ class RAGAgent:
         Returns:
             Assistant's response
         """
+        return _run_sync(self.achat(user_input, use_rag))
+            
+    def _embed_query(self, query: str) -> Optional["np.ndarray"]:
+        """Unit-normalised query embedding for the semantic cache, or None."""
+        embeddings = getattr(self.retrieval, "embeddings", None)
+        if np is None or embeddings is None:
+            return None
+            
+        try:
+            vec = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+            norm = np.linalg.norm(vec)
+            return vec / norm if norm else None
+        except Exception as e:
+            logger.error(f"Error embedding query for semantic cache: {e}")
+            return None
+            
+    def _semantic_lookup(self, q_emb: Optional["np.ndarray"]) -> Optional[str]:
+        """Return cached context for a near-duplicate query (cosine >= threshold)."""
+        if q_emb is None or self._sem_cache_vecs is None:
+            return None
+            
+        sims = self._sem_cache_vecs @ q_emb
+        best = int(sims.argmax())
+        if sims[best] >= _SEMANTIC_CACHE_THRESHOLD:
+            return self._sem_cache_ctx[best]
+        return None
+        
+    def _semantic_store(self, q_emb: Optional["np.ndarray"], context: Optional[str]):
+        """Remember a query's context, evicting the oldest entry at capacity."""
+        # Misses aren't cached so newly ingested documents are picked up
+        if q_emb is None or not context or "No relevant documents found" in context:
+            return
+            
+        if self._sem_cache_vecs is None or self._sem_cache_vecs.shape[1] != q_emb.shape[0]:
+            self._sem_cache_vecs = q_emb[None, :]
+            self._sem_cache_ctx = [context]
+            return
+            
+        self._sem_cache_vecs = np.vstack([self._sem_cache_vecs[-(_SEMANTIC_CACHE_SIZE - 1):], q_emb])
+        self._sem_cache_ctx = self._sem_cache_ctx[-(_SEMANTIC_CACHE_SIZE - 1):] + [context]
+        
+    def clear_semantic_cache(self):
+        """Drop all cached query contexts (e.g. after the knowledge base changes)."""
+        self._sem_cache_vecs = None
+        self._sem_cache_ctx = []
+        
+    async def _aget_rag_context(self, query: str) -> Optional[str]:
+        """Fetch RAG context for a query without blocking the event loop."""
+        if not self.retrieval.is_available():
+            return None
+            
+        # Near-duplicate questions reuse the context retrieved for the earlier one
+        q_emb = await asyncio.to_thread(self._embed_query, query)
+        cached = self._semantic_lookup(q_emb)
+        if cached is not None:
+            return cached
+            
+        aget_context = getattr(self.retrieval, "aget_context_for_query", None)
+        if aget_context:
+            context = await aget_context(query, max_tokens=_RAG_CONTEXT_TOKENS)
+        else:
+            context = await asyncio.to_thread(self.retrieval.get_context_for_query, query, max_tokens=_RAG_CONTEXT_TOKENS)
+            
+        self._semantic_store(q_emb, context)
+        return context
+        
+    async def achat(self, user_input: str, use_rag: bool = True) -> str:
+        """
+        Async chat function; awaits retrieval and the model so callers can
+        run several conversations concurrently with asyncio.gather.
+        
+        Args:
+            user_input: User's message
+            use_rag: Whether to use RAG (retrieval) for context
+            
+        Returns:
+            Assistant's response
+        """
+        response = ""
+        async for kind, text in self._achat_events(user_input, use_rag):
+            if kind == "final":
+                response = text
+        return response
+        
+    def stream_chat(self, user_input: str, use_rag: bool = True) -> Iterator[str]:
+        """Sync view of astream_chat for callers such as st.write_stream."""
+        return _iter_sync(self.astream_chat(user_input, use_rag))
+        
+    async def astream_chat(self, user_input: str, use_rag: bool = True) -> AsyncIterator[str]:
+        """
+        Stream the assistant's reply as it is generated.
+        
+        Chunks are the raw model text; tool calls are expanded once the reply is
+        complete and the processed text is what gets saved to the session.
+        
+        Args:
+            user_input: User's message
+            use_rag: Whether to use RAG (retrieval) for context
+            
+        Yields:
+            Response text chunks
+        """
+        streamed = False
+        async for kind, text in self._achat_events(user_input, use_rag):
+            if kind == "chunk":
+                streamed = True
+                yield text
+            elif not streamed:
+                # Nothing was streamed (e.g. no model configured): surface the message
+                yield text
+                
+    async def _achat_events(self, user_input: str, use_rag: bool) -> AsyncIterator[Tuple[str, str]]:
+        """Run one chat turn, yielding ("chunk", text) while streaming and then ("final", response)."""
         if not self.current_model:
-            return "No AI model selected. Please configure a model first."
+            yield ("final", "No AI model selected. Please configure a model first.")
+            return
             
         # Ensure we have a current session
         if not self.current_session_id:
@@ -516,8 +959,10 @@ class RAGAgent:
             
         current_session = self.get_current_session()
         if not current_session:
-            return "Error: Could not create or access chat session."
+            yield ("final", "Error: Could not create or access chat session.")
+            return
             
+        title_task = None
         try:
             # Add user message to session
             user_msg = ChatMessage(
@@ -525,26 +970,46 @@ class RAGAgent:
                 content=user_input,
                 timestamp=datetime.now()
             )
+            wire = self._session_wire(current_session)
             current_session.messages.append(user_msg)
+            wire.append(("user", user_input))
             
-            # Prepare messages for the model
-            messages_for_model = []
+            # Start retrieval now so vector search overlaps with prompt assembly
+            context_task = asyncio.create_task(self._aget_rag_context(user_input)) if use_rag else None
             
-            # System prompt
-            system_prompt = self._create_system_prompt(use_rag, user_input if use_rag else None)
-            if system_prompt:
-                messages_for_model.append(ChatMessage(
-                    role="system",
-                    content=system_prompt,
-                    timestamp=datetime.now()
-                ))
+            # Prepare messages for the model in LangChain's (role, content) form; the
+            # system prompt stays byte-identical across turns so servers can cache the prefix
+            system_prompt = self._create_system_prompt()
+            messages_for_model = [("system", system_prompt)]
             
-            # Add recent conversation history (last 10 messages)
-            recent_messages = current_session.messages[-10:]
-            messages_for_model.extend(recent_messages)
+            # Add as much recent conversation history as fits the token budget,
+            # reserving room for the retrieved context while it is still in flight
+            budget = self.config.max_context_length - _count_tokens(system_prompt)
+            if context_task:
+                budget -= _RAG_CONTEXT_TOKENS
+            history = _pack_messages(wire, budget)
             
-            # Generate response
-            response = self.current_model.generate_response(messages_for_model)
+            context_msg = self._create_context_message(await context_task) if context_task else None
+            
+            # Retrieved context goes just before the latest user turn
+            messages_for_model.extend(history[:-1])
+            if context_msg:
+                messages_for_model.append(context_msg)
+            messages_for_model.append(history[-1])
+            
+            # On the first exchange the title is generated concurrently with the reply
+            topic = user_input[:100]
+            if len(current_session.messages) == 1:
+                title_task = asyncio.create_task(
+                    self.current_model.agenerate_response(self._title_prompt(topic))
+                )
+                
+            # Stream the response
+            chunks = []
+            async for chunk in self.current_model.astream_response(messages_for_model):
+                chunks.append(chunk)
+                yield ("chunk", chunk)
+            response = "".join(chunks)
             
             if response:
                 # Process any tool calls in the response
@@ -558,67 +1023,69 @@ class RAGAgent:
                     metadata={"model_used": self.config.selected_model}
                 )
                 current_session.messages.append(assistant_msg)
+                wire.append(("assistant", processed_response))
                 
                 # Update session title if this is the first exchange
-                if len(current_session.messages) <= 2:
-                    current_session.title = self.generate_session_title(current_session.messages)
+                if title_task:
+                    try:
+                        raw_title = await title_task
+                    except Exception as e:
+                        logger.error(f"Error generating title: {e}")
+                        raw_title = None
+                    title_task = None
+                    current_session.title = self._finalize_title(raw_title, topic)
                     
                 # Update timestamps
                 current_session.updated_at = datetime.now()
                 current_session.model_used = self.config.selected_model
                 
                 # Save session
+                self._dirty.add(current_session.id)
                 self._save_chat_sessions()
                 
-                return processed_response
+                yield ("final", processed_response)
             else:
-                return "Sorry, I couldn't generate a response. Please try again."
+                yield ("final", "Sorry, I couldn't generate a response. Please try again.")
                 
         except Exception as e:
             logger.error(f"Error in chat: {e}")
-            return f"Error generating response: {str(e)}"
+            yield ("final", f"Error generating response: {str(e)}")
             
-    def _create_system_prompt(self, use_rag: bool, query: str = None) -> str:
-        """Create system prompt with optional RAG context."""
-        base_prompt = """You are a helpful AI assistant specialized in development tasks. You can help with:
-- Code generation and review
-- Debugging and troubleshooting  
-- Explaining technical concepts
-- Document analysis and summarization
-- Architecture and design guidance
-
-You have access to the following tools that you can use by including tool calls in your response:
-
-🧮 **Calculator**: Use [TOOL:calculator:expression] for mathematical calculations
-   Example: [TOOL:calculator:2+2*3] or [TOOL:calculator:sqrt(16)]
-
-🔍 **Web Search**: Use [TOOL:web_search:query] to search for current information
-   Example: [TOOL:web_search:latest Python features 2024]
-
-🔧 **Code Analysis**: Use [TOOL:code_analysis:code] or [TOOL:code_analysis:language:code] to analyze code
-   Example: [TOOL:code_analysis:python:def hello(): print("world")]
-
-When using tools, the results will be automatically inserted into your response. Use these tools when they would be helpful for answering the user's question.
-
-Provide clear, accurate, and helpful responses. Use markdown formatting for code blocks."""
-
-        if use_rag and query and self.retrieval.is_available():
-            # Get relevant context from documents
-            context = self.retrieval.get_context_for_query(query, max_tokens=2000)
+        finally:
+            if title_task and not title_task.done():
+                title_task.cancel()
             
-            if context and "No relevant documents found" not in context:
-                rag_prompt = f"""
-
-## Available Context
+    def _create_system_prompt(self) -> str:
+        """Create the static system prompt describing the assistant and its tools."""
+        return BASE_TOOL_PROMPT
+        
+    def _create_context_message(self, context: Optional[str]) -> Optional[WireMessage]:
+        """Wrap retrieved RAG context in its own message, or None if there is none."""
+        if not context or "No relevant documents found" in context:
+            return None
+            
+        return (
+            "user",
+            f"""## Available Context
 You have access to the following relevant information from the user's documents:
 
 {context}
 
 Use this context to provide more accurate and specific answers when relevant. If the context doesn't contain relevant information for the user's question, rely on your general knowledge."""
+        )
 
-                return base_prompt + rag_prompt
-                
-        return base_prompt
+# Global agent instance, created on first use so importing this module stays cheap
+_rag_agent: Optional[RAGAgent] = None
+
+def get_rag_agent() -> RAGAgent:
+    """Return the shared RAGAgent, creating it on first call."""
+    global _rag_agent
+    if _rag_agent is None:
+        _rag_agent = RAGAgent()
+    return _rag_agent
 
-# Global agent instance
-rag_agent = RAGAgent()
+def __getattr__(name: str) -> Any:
+    """Keep the old ``rag_agent`` module attribute working, resolved lazily."""
+    if name == "rag_agent":
+        return get_rag_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
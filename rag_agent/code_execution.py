@@ -4,24 +4,64 @@ Provides sandboxed Python execution with security controls.
 """
 
 import ast
+import hashlib
 import sys
+import types
 import io
 import time
+import queue
+import threading
 import subprocess
 import tempfile
 import os
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from pathlib import Path
 import logging
+from collections import OrderedDict
 from contextlib import redirect_stdout, redirect_stderr
+from functools import lru_cache, partial
 import traceback
 import signal
+import ctypes
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait as futures_wait
 
 logger = logging.getLogger(__name__)
 
+_COMPILE_CACHE_SIZE = 128
+_PARSE_CACHE_SIZE = 128
+# Seconds an interrupted worker gets to unwind (and restore stdout) before execute_code returns
+_INTERRUPT_GRACE = 1.0
+
+# Names that make the executor import and inject numpy/pandas
+_DATA_LIB_NAMES = frozenset({'np', 'numpy', 'pd', 'pandas'})
+
+# Names checked in the validator's hot loop; frozensets shared by every visitor
+_DANGEROUS_IMPORTS = frozenset({
+    'os', 'subprocess', 'sys', 'eval', 'exec', 'compile', 
+    'open', '__import__', 'importlib', 'socket', 'urllib',
+    'requests', 'http', 'ftplib', 'smtplib', 'telnetlib',
+    'webbrowser', 'ctypes', 'multiprocessing', 'threading',
+    'asyncio', 'concurrent', 'shutil', 'tempfile', 'pickle'
+})
+
+_DANGEROUS_FUNCTIONS = frozenset({
+    'eval', 'exec', 'compile', 'open', '__import__', 'globals',
+    'locals', 'vars', 'dir', 'getattr', 'setattr', 'delattr',
+    'hasattr', 'callable', 'isinstance', 'issubclass'
+})
+
+_DANGEROUS_ATTRIBUTES = frozenset({
+    '__class__', '__bases__', '__subclasses__', '__mro__',
+    '__globals__', '__locals__', '__dict__', '__code__',
+    '__func__', '__self__', '__module__', '__builtins__', '__closure__'
+})
+
 class CodeExecutionResult:
     """Result of code execution."""
     
+    __slots__ = ('success', 'output', 'error', 'execution_time', 'return_value', 'warnings',
+                 '_exc', '_traceback')
+    
     def __init__(self):
         self.success: bool = False
         self.output: str = ""
@@ -29,29 +69,23 @@ class CodeExecutionResult:
         self.execution_time: float = 0.0
         self.return_value: Any = None
         self.warnings: List[str] = []
+        self._exc: Optional[BaseException] = None
+        self._traceback: Optional[str] = None
+    
+    @property
+    def traceback(self) -> str:
+        """Full traceback of the execution error, formatted on first access."""
+        if self._traceback is None:
+            e = self._exc
+            self._traceback = "".join(traceback.format_exception(type(e), e, e.__traceback__)) if e else ""
+        return self._traceback
 
 class SecurityValidator:
     """Validates code for security before execution."""
     
-    DANGEROUS_IMPORTS = {
-        'os', 'subprocess', 'sys', 'eval', 'exec', 'compile', 
-        'open', '__import__', 'importlib', 'socket', 'urllib',
-        'requests', 'http', 'ftplib', 'smtplib', 'telnetlib',
-        'webbrowser', 'ctypes', 'multiprocessing', 'threading',
-        'asyncio', 'concurrent', 'shutil', 'tempfile', 'pickle'
-    }
-    
-    DANGEROUS_FUNCTIONS = {
-        'eval', 'exec', 'compile', 'open', '__import__', 'globals',
-        'locals', 'vars', 'dir', 'getattr', 'setattr', 'delattr',
-        'hasattr', 'callable', 'isinstance', 'issubclass'
-    }
-    
-    DANGEROUS_ATTRIBUTES = {
-        '__class__', '__bases__', '__subclasses__', '__mro__',
-        '__globals__', '__locals__', '__dict__', '__code__',
-        '__func__', '__self__', '__module__'
-    }
+    DANGEROUS_IMPORTS = _DANGEROUS_IMPORTS
+    DANGEROUS_FUNCTIONS = _DANGEROUS_FUNCTIONS
+    DANGEROUS_ATTRIBUTES = _DANGEROUS_ATTRIBUTES
     
     @classmethod
     def validate_code(cls, code: str) -> Tuple[bool, List[str]]:
@@ -60,59 +94,17 @@ class SecurityValidator:
         
         try:
             # Parse the code into AST
-            tree = ast.parse(code)
-            
-            # Check for dangerous patterns
-            for node in ast.walk(tree):
-                # Check imports
-                if isinstance(node, ast.Import):
-                    for alias in node.names:
-                        if alias.name in cls.DANGEROUS_IMPORTS:
-                            warnings.append(f"Dangerous import detected: {alias.name}")
-                
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module in cls.DANGEROUS_IMPORTS:
-                        warnings.append(f"Dangerous import detected: {node.module}")
-                
-                # Check function calls
-                elif isinstance(node, ast.Call):
-                    if isinstance(node.func, ast.Name):
-                        if node.func.id in cls.DANGEROUS_FUNCTIONS:
-                            warnings.append(f"Dangerous function call: {node.func.id}")
-                
-                # Check attribute access
-                elif isinstance(node, ast.Attribute):
-                    if node.attr in cls.DANGEROUS_ATTRIBUTES:
-                        warnings.append(f"Dangerous attribute access: {node.attr}")
-                
-                # Check for infinite loops (simple heuristic)
-                elif isinstance(node, ast.While):
-                    if isinstance(node.test, ast.Constant) and node.test.value is True:
-                        warnings.append("Potential infinite loop detected (while True)")
+            tree = _parse_cached(code)
             
-            # Additional string-based checks
-            code_lower = code.lower()
-            if 'while true:' in code_lower and 'break' not in code_lower:
-                warnings.append("Potential infinite loop without break condition")
-            
-            if 'import os' in code or 'from os' in code:
-                warnings.append("OS module usage detected")
-            
-            # Check for very long loops
-            for line in code.split('\n'):
-                if 'for' in line and 'range(' in line:
-                    try:
-                        # Extract range parameter
-                        range_match = line.split('range(')[1].split(')')[0]
-                        if range_match.isdigit() and int(range_match) > 100000:
-                            warnings.append(f"Large loop detected: range({range_match})")
-                    except:
-                        pass
-            
-            # If there are critical warnings, reject the code
-            critical_warnings = [w for w in warnings if any(danger in w.lower() for danger in ['import', 'infinite', 'dangerous'])]
+            # Check for dangerous patterns in a single pass, stopping at the first critical one
+            visitor = _SecurityVisitor(cls, fail_fast=True)
+            try:
+                visitor.visit(tree)
+            except _CriticalViolation as e:
+                return False, [str(e)]
+            warnings.extend(visitor.security_warnings())
             
-            return len(critical_warnings) == 0, warnings
+            return _is_safe(warnings), warnings
             
         except SyntaxError as e:
             warnings.append(f"Syntax error: {str(e)}")
@@ -121,6 +113,285 @@ class SecurityValidator:
             warnings.append(f"Code validation error: {str(e)}")
             return False, warnings
 
+class _CriticalViolation(Exception):
+    """Raised by a fail-fast visitor on the first warning that makes code unsafe."""
+
+class _SecurityVisitor(ast.NodeVisitor):
+    """Single-pass AST visitor collecting SecurityValidator warnings."""
+    
+    def __init__(self, validator: type, fail_fast: bool = False):
+        self.warnings: List[str] = []
+        self._fail_fast = fail_fast
+        self.notes: List[str] = []  # heuristic findings, reported after the dangerous ones
+        self._imports = validator.DANGEROUS_IMPORTS
+        self._functions = validator.DANGEROUS_FUNCTIONS
+        self._attributes = validator.DANGEROUS_ATTRIBUTES
+        self._break_stack: List[bool] = []
+        self._dispatch = {
+            ast.Import: self.visit_Import,
+            ast.ImportFrom: self.visit_ImportFrom,
+            ast.Call: self.visit_Call,
+            ast.Attribute: self.visit_Attribute,
+            ast.While: self.visit_While,
+            ast.For: self.visit_For,
+            ast.AsyncFor: self._visit_loop,
+            ast.Break: self.visit_Break,
+        }
+    
+    def _critical(self, message: str):
+        self.warnings.append(message)
+        if self._fail_fast:
+            raise _CriticalViolation(message)
+    
+    def visit(self, node: ast.AST):
+        return self._dispatch.get(type(node), self.generic_visit)(node)
+    
+    def generic_visit(self, node: ast.AST):
+        # Dispatch children straight from the table instead of via visit()
+        dispatch = self._dispatch
+        descend = self.generic_visit
+        for child in ast.iter_child_nodes(node):
+            dispatch.get(type(child), descend)(child)
+    
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            if alias.name in self._imports:
+                self._critical(f"Dangerous import detected: {alias.name}")
+            if alias.name == 'os':
+                self.notes.append("OS module usage detected")
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        if node.module in self._imports:
+            self._critical(f"Dangerous import detected: {node.module}")
+        if node.module == 'os':
+            self.notes.append("OS module usage detected")
+    
+    def visit_Call(self, node: ast.Call):
+        func = node.func
+        if isinstance(func, ast.Name):
+            if func.id in self._functions:
+                self._critical(f"Dangerous function call: {func.id}")
+            
+            # Check for very long loops
+            elif func.id == 'range' and 1 <= len(node.args) <= 3:
+                # Read integer literals straight off the call node; len(range) is O(1)
+                values = [arg.value for arg in node.args
+                          if isinstance(arg, ast.Constant) and type(arg.value) is int]
+                if len(values) == len(node.args) and (len(values) < 3 or values[2] != 0):
+                    if len(range(*values)) > 100000:
+                        self.notes.append(f"Large loop detected: range({', '.join(map(str, values))})")
+        self.generic_visit(node)
+    
+    def visit_Attribute(self, node: ast.Attribute):
+        if node.attr in self._attributes:
+            self._critical(f"Dangerous attribute access: {node.attr}")
+        self.generic_visit(node)
+    
+    def visit_While(self, node: ast.While):
+        # Check for infinite loops (simple heuristic)
+        infinite = isinstance(node.test, ast.Constant) and node.test.value is True
+        if infinite:
+            self._critical("Potential infinite loop detected (while True)")
+        
+        # Breaks are recorded against the innermost loop as the walk descends
+        self._break_stack.append(False)
+        self.generic_visit(node)
+        if not self._break_stack.pop() and infinite:
+            self.warnings.append("Potential infinite loop without break condition")
+    
+    def visit_For(self, node: ast.For):
+        self._visit_loop(node)
+    
+    def _visit_loop(self, node: ast.AST):
+        # A break in a nested for loop exits that loop, not the enclosing while
+        self._break_stack.append(False)
+        self.generic_visit(node)
+        self._break_stack.pop()
+    
+    def visit_Break(self, node: ast.Break):
+        if self._break_stack:
+            self._break_stack[-1] = True
+    
+    def security_warnings(self) -> List[str]:
+        """All warnings from the walk, heuristic notes last."""
+        return self.warnings + self.notes
+
+class CombinedCodeVisitor(_SecurityVisitor):
+    """Collects security warnings, structure analysis and suggestions in one traversal."""
+    
+    def __init__(self, validator: type):
+        super().__init__(validator)
+        self.analysis: Dict[str, Any] = {
+            'functions': [],
+            'classes': [],
+            'imports': [],
+            'variables': [],
+            'complexity_score': 0,
+        }
+        self.has_docstrings = False
+        self.long_functions: List[str] = []
+        self.has_numeric_literal = False
+        self._dispatch.update({
+            ast.FunctionDef: self.visit_FunctionDef,
+            ast.ClassDef: self.visit_ClassDef,
+            ast.Assign: self.visit_Assign,
+            ast.For: self.visit_For,
+            ast.If: self.visit_If,
+            ast.Constant: self.visit_Constant,
+        })
+    
+    def visit_Import(self, node: ast.Import):
+        super().visit_Import(node)
+        for alias in node.names:
+            self.analysis['imports'].append(alias.name)
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        super().visit_ImportFrom(node)
+        if node.module:
+            self.analysis['imports'].append(node.module)
+    
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        self.analysis['functions'].append({
+            'name': node.name,
+            'args': [arg.arg for arg in node.args.args],
+            'line': node.lineno
+        })
+        self.analysis['complexity_score'] += 2
+        
+        # Check for docstring
+        if (node.body and 
+            isinstance(node.body[0], ast.Expr) and 
+            isinstance(node.body[0].value, ast.Constant) and 
+            isinstance(node.body[0].value.value, str)):
+            self.has_docstrings = True
+        
+        # Check function length
+        if len(node.body) > 20:
+            self.long_functions.append(node.name)
+        self.generic_visit(node)
+    
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self.analysis['classes'].append({
+            'name': node.name,
+            'line': node.lineno
+        })
+        self.analysis['complexity_score'] += 3
+        self.generic_visit(node)
+    
+    def visit_Assign(self, node: ast.Assign):
+        # Names come from the targets alone; the value subtree is left to generic_visit
+        for target in node.targets:
+            self.analysis['variables'].extend(_target_names(target))
+        self.generic_visit(node)
+    
+    def visit_For(self, node: ast.For):
+        self.analysis['complexity_score'] += 1
+        super().visit_For(node)
+    
+    def visit_While(self, node: ast.While):
+        self.analysis['complexity_score'] += 1
+        super().visit_While(node)
+    
+    def visit_If(self, node: ast.If):
+        self.analysis['complexity_score'] += 1
+        self.generic_visit(node)
+    
+    def visit_Constant(self, node: ast.Constant):
+        # bool is an int subclass but True/False are not magic numbers
+        if type(node.value) in (int, float, complex):
+            self.has_numeric_literal = True
+    
+    def structure(self, code: str) -> Dict[str, Any]:
+        """Structure analysis for the visited code."""
+        lines = code.split('\n')
+        return dict(
+            self.analysis,
+            lines_of_code=sum(1 for line in lines if line.strip()),
+            total_lines=len(lines),
+        )
+    
+    def suggestions(self, code: str) -> List[str]:
+        """Improvement suggestions for the visited code."""
+        suggestions = []
+        
+        # Generate suggestions
+        if self.analysis['functions'] and not self.has_docstrings:
+            suggestions.append("Consider adding docstrings to your functions")
+        
+        if self.long_functions:
+            suggestions.append(f"Consider breaking down long functions: {', '.join(self.long_functions)}")
+        
+        # Check for hardcoded values
+        if self.has_numeric_literal and 'range(' not in code:
+            suggestions.append("Consider using named constants instead of magic numbers")
+        
+        # Check for repeated code patterns, stopping at the first duplicate line
+        seen = set()
+        for raw in code.split('\n'):
+            line = raw.strip()
+            if not line:
+                continue
+            if line in seen:
+                suggestions.append("Consider extracting repeated code into functions")
+                break
+            seen.add(line)
+        
+        return suggestions
+
+def _target_names(target: ast.AST) -> Iterator[str]:
+    """Names bound by an assignment target, unpacking tuples, lists and starred names."""
+    if isinstance(target, ast.Name):
+        yield target.id
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        for elt in target.elts:
+            yield from _target_names(elt)
+    elif isinstance(target, ast.Starred):
+        yield from _target_names(target.value)
+
+# Parsed trees keyed by source digest, so the cache does not pin source strings
+_parse_cache: "OrderedDict[bytes, ast.Module]" = OrderedDict()
+_parse_lock = threading.Lock()
+
+def _source_key(code: str) -> bytes:
+    """Digest identifying a snippet in the parse and compile caches."""
+    return hashlib.blake2b(code.encode()).digest()
+
+def _parse_cached(code: str, key: Optional[bytes] = None) -> ast.Module:
+    """Parse source once per distinct snippet; the tree is shared read-only."""
+    if key is None:
+        key = _source_key(code)
+    with _parse_lock:
+        tree = _parse_cache.get(key)
+        if tree is not None:
+            _parse_cache.move_to_end(key)
+            return tree
+    
+    tree = ast.parse(code, mode='exec', type_comments=False, feature_version=sys.version_info[:2])
+    with _parse_lock:
+        _parse_cache[key] = tree
+        if len(_parse_cache) > _PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return tree
+
+@lru_cache(maxsize=1)
+def _load_data_libs() -> Dict[str, Any]:
+    """Import numpy and pandas on first use (common for data analysis)."""
+    try:
+        import numpy as np
+        import pandas as pd
+        return {
+            'np': np,
+            'numpy': np,
+            'pd': pd,
+            'pandas': pd,
+        }
+    except ImportError:
+        return {}
+
+def _is_safe(warnings: List[str]) -> bool:
+    """Code is unsafe if any warning is critical."""
+    return not any(danger in w.lower() for w in warnings for danger in ('import', 'infinite', 'dangerous'))
+
 class SafeExecutor:
     """Safe Python code executor with security controls."""
     
@@ -128,6 +399,9 @@ class SafeExecutor:
         self.timeout = timeout
         self.max_output_length = max_output_length
         self.validator = SecurityValidator()
+        self._safe_globals_template: Optional[Dict[str, Any]] = None
+        self._compile_cache: "OrderedDict[bytes, types.CodeType]" = OrderedDict()
+        self._compile_lock = threading.Lock()
     
     def execute_code(self, code: str, context: Optional[Dict[str, Any]] = None) -> CodeExecutionResult:
         """Execute Python code safely."""
@@ -135,7 +409,7 @@ class SafeExecutor:
         start_time = time.time()
         
         try:
-            # Validate code security
+            # Validate code security; rejection stops at the first critical finding
             is_safe, warnings = self.validator.validate_code(code)
             result.warnings = warnings
             
@@ -144,7 +418,8 @@ class SafeExecutor:
                 return result
             
             # Prepare execution environment
-            safe_globals = self._create_safe_globals()
+            code_obj, uses_data_libs = self._compile(code)
+            safe_globals = self._fresh_globals(uses_data_libs)
             
             # Add context variables if provided
             if context:
@@ -155,32 +430,30 @@ class SafeExecutor:
             stderr_capture = io.StringIO()
             
             # Execute with timeout
+            err_parts = []
             try:
-                with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-                    # Set up timeout handler
-                    def timeout_handler(signum, frame):
-                        raise TimeoutError("Code execution timed out")
-                    
-                    signal.signal(signal.SIGALRM, timeout_handler)
-                    signal.alarm(self.timeout)
-                    
-                    try:
-                        # Execute the code
-                        exec_result = exec(code, safe_globals)
-                        result.return_value = exec_result
-                        result.success = True
-                    finally:
-                        signal.alarm(0)  # Cancel timeout
+                result.return_value = self._run_with_timeout(
+                    code_obj, safe_globals, self.timeout, stdout_capture, stderr_capture
+                )
+                result.success = True
             
             except TimeoutError:
-                result.error = f"Code execution timed out after {self.timeout} seconds"
+                err_parts.append(f"Code execution timed out after {self.timeout} seconds")
             except Exception as e:
-                result.error = f"Execution error: {str(e)}\n{traceback.format_exc()}"
+                result._exc = e
+                err_parts.append("Execution error: ")
+                err_parts.extend(traceback.format_exception_only(type(e), e))
             
             # Capture outputs
             result.output = stdout_capture.getvalue()
-            if stderr_capture.getvalue():
-                result.error += f"\nStderr: {stderr_capture.getvalue()}"
+            stderr_output = stderr_capture.getvalue()
+            if stderr_output:
+                # Cap stderr before it is joined into the error message
+                err_parts.append("\nStderr: ")
+                err_parts.append(stderr_output[:self.max_output_length])
+                if len(stderr_output) > self.max_output_length:
+                    err_parts.append("\n[Stderr truncated...]")
+            result.error = "".join(err_parts)
             
             # Limit output length
             if len(result.output) > self.max_output_length:
@@ -194,6 +467,163 @@ class SafeExecutor:
         
         return result
     
+    def stream_execute(self, code: str, context: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Execute Python code safely, yielding printed output as it is produced."""
+        is_safe, warnings = self.validator.validate_code(code)
+        if not is_safe:
+            yield "Code rejected due to security concerns: " + "; ".join(warnings) + "\n"
+            return
+        
+        output: queue.SimpleQueue = queue.SimpleQueue()
+        done = object()
+        
+        # Route print() to the queue instead of redirecting the process-wide stdout.
+        # The builtin print and SimpleQueue.put are both C-level, so no Python
+        # function (and with it the real __builtins__) is reachable from the sandbox
+        code_obj, uses_data_libs = self._compile(code)
+        safe_globals = self._fresh_globals(uses_data_libs)
+        safe_globals['__builtins__']['print'] = partial(print, file=types.SimpleNamespace(write=output.put))
+        if context:
+            safe_globals.update(context)
+        
+        def run():
+            try:
+                exec(code_obj, safe_globals)
+            except Exception as e:
+                output.put(f"Execution error: {str(e)}\n")
+            finally:
+                output.put(done)
+        
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        
+        deadline = time.monotonic() + self.timeout
+        emitted = 0
+        # print() writes its arguments, separators and end separately; emit whole lines
+        pending: List[str] = []
+        pending_length = 0
+        while True:
+            try:
+                item = output.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                # Stop the worker rather than leave it running in the server process
+                self._interrupt(worker.ident)
+                item = None
+            
+            if item is not None and item is not done:
+                pending.append(item)
+                pending_length += len(item)
+                if not item.endswith('\n') and pending_length <= self.max_output_length:
+                    continue
+            
+            chunk = "".join(pending)
+            pending.clear()
+            pending_length = 0
+            if chunk:
+                remaining = self.max_output_length - emitted
+                emitted += len(chunk)
+                if emitted > self.max_output_length:
+                    yield chunk[:remaining] + "\n[Output truncated...]"
+                    return
+                yield chunk
+            
+            if item is None:
+                yield f"\nCode execution timed out after {self.timeout} seconds\n"
+                return
+            if item is done:
+                return
+    
+    @staticmethod
+    def _run_with_timeout(code_obj: types.CodeType, globals_: Dict[str, Any], timeout: int,
+                          stdout: io.StringIO, stderr: io.StringIO) -> Any:
+        """Execute compiled code with its output captured, raising TimeoutError past the timeout."""
+        if hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread():
+            # Fast path: SIGALRM only works on the main thread of Unix
+            def timeout_handler(signum, frame):
+                raise TimeoutError("Code execution timed out")
+            
+            signal.signal(signal.SIGALRM, timeout_handler)
+            signal.alarm(timeout)
+            try:
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    return exec(code_obj, globals_)
+            finally:
+                signal.alarm(0)  # Cancel timeout
+        
+        # Worker threads and Windows: run in a helper thread and interrupt it on timeout.
+        # The redirect lives in the worker, so it is only undone once the code stops running
+        thread_ids = []
+        started = threading.Event()
+        
+        def run():
+            thread_ids.append(threading.get_ident())
+            started.set()
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                return exec(code_obj, globals_)
+        
+        pool = ThreadPoolExecutor(max_workers=1)
+        future = pool.submit(run)
+        try:
+            # Start the clock only once the worker's ident is known and it can be interrupted
+            started.wait()
+            return future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            SafeExecutor._interrupt(thread_ids[0])
+            futures_wait([future], timeout=_INTERRUPT_GRACE)
+            raise TimeoutError("Code execution timed out")
+        finally:
+            pool.shutdown(wait=False)
+    
+    @staticmethod
+    def _interrupt(thread_id: int) -> None:
+        """Raise TimeoutError inside a running worker thread."""
+        # Delivered at the next bytecode boundary; code blocked in C keeps running
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(
+            ctypes.c_ulong(thread_id), ctypes.py_object(TimeoutError)
+        )
+    
+    def _compile(self, code: str) -> Tuple[types.CodeType, bool]:
+        """Compile validated code, caching the code object by exact source text.
+        
+        Keys are a digest of the source as given, so even whitespace-only edits
+        miss the cache. The tree comes from the validator's parse cache.
+        
+        Returns:
+            (code object, whether the code references numpy/pandas names)
+        """
+        key = _source_key(code)
+        with self._compile_lock:
+            entry = self._compile_cache.get(key)
+            if entry is not None:
+                self._compile_cache.move_to_end(key)
+                return entry
+        
+        tree = _parse_cached(code, key)
+        uses_data_libs = any(
+            isinstance(n, ast.Name) and n.id in _DATA_LIB_NAMES for n in ast.walk(tree)
+        )
+        entry = (compile(tree, '<exec>', 'exec'), uses_data_libs)
+        with self._compile_lock:
+            self._compile_cache[key] = entry
+            if len(self._compile_cache) > _COMPILE_CACHE_SIZE:
+                self._compile_cache.popitem(last=False)
+        return entry
+    
+    def _fresh_globals(self, data_libs: bool = False) -> Dict[str, Any]:
+        """Copy of the safe globals template, built once on first use.
+        
+        numpy and pandas are only imported and injected when data_libs is set.
+        """
+        if self._safe_globals_template is None:
+            self._safe_globals_template = self._create_safe_globals()
+        
+        # Copy the builtins too so one run can't leak changes into the next
+        safe_globals = self._safe_globals_template.copy()
+        safe_globals['__builtins__'] = safe_globals['__builtins__'].copy()
+        if data_libs:
+            safe_globals.update(_load_data_libs())
+        return safe_globals
+    
     def _create_safe_globals(self) -> Dict[str, Any]:
         """Create a safe globals dictionary for code execution."""
         # Start with basic builtins
@@ -248,130 +678,43 @@ class SafeExecutor:
         except ImportError:
             pass
         
-        # Add numpy and pandas if available (common for data analysis)
-        try:
-            import numpy as np
-            import pandas as pd
-            safe_globals.update({
-                'np': np,
-                'numpy': np,
-                'pd': pd,
-                'pandas': pd,
-            })
-        except ImportError:
-            pass
-        
         return safe_globals
 
 class CodeAnalyzer:
     """Analyzes and explains code."""
     
     @staticmethod
-    def analyze_code_structure(code: str) -> Dict[str, Any]:
-        """Analyze the structure of code."""
+    def analyze_all(code: str) -> Tuple[bool, List[str], Dict[str, Any], List[str]]:
+        """Validate, analyze and suggest improvements from one parse and one traversal.
+        
+        Returns:
+            (is_safe, warnings, analysis, suggestions)
+        """
         try:
-            tree = ast.parse(code)
-            
-            analysis = {
-                'functions': [],
-                'classes': [],
-                'imports': [],
-                'variables': [],
-                'complexity_score': 0,
-                'lines_of_code': len([line for line in code.split('\n') if line.strip()]),
-                'total_lines': len(code.split('\n'))
-            }
+            tree = _parse_cached(code)
             
-            for node in ast.walk(tree):
-                if isinstance(node, ast.FunctionDef):
-                    analysis['functions'].append({
-                        'name': node.name,
-                        'args': [arg.arg for arg in node.args.args],
-                        'line': node.lineno
-                    })
-                    analysis['complexity_score'] += 2
-                
-                elif isinstance(node, ast.ClassDef):
-                    analysis['classes'].append({
-                        'name': node.name,
-                        'line': node.lineno
-                    })
-                    analysis['complexity_score'] += 3
-                
-                elif isinstance(node, ast.Import):
-                    for alias in node.names:
-                        analysis['imports'].append(alias.name)
-                
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module:
-                        analysis['imports'].append(node.module)
-                
-                elif isinstance(node, ast.Assign):
-                    for target in node.targets:
-                        if isinstance(target, ast.Name):
-                            analysis['variables'].append(target.id)
-                
-                elif isinstance(node, (ast.For, ast.While)):
-                    analysis['complexity_score'] += 1
-                
-                elif isinstance(node, ast.If):
-                    analysis['complexity_score'] += 1
+            visitor = CombinedCodeVisitor(SecurityValidator)
+            visitor.visit(tree)
+            warnings = visitor.security_warnings()
             
-            return analysis
+            return _is_safe(warnings), warnings, visitor.structure(code), visitor.suggestions(code)
             
         except SyntaxError as e:
-            return {'error': f'Syntax error: {str(e)}'}
+            return False, [f"Syntax error: {str(e)}"], {'error': f'Syntax error: {str(e)}'}, []
         except Exception as e:
-            return {'error': f'Analysis error: {str(e)}'}
+            return False, [f"Code validation error: {str(e)}"], {'error': f'Analysis error: {str(e)}'}, []
+    
+    @staticmethod
+    def analyze_code_structure(code: str) -> Dict[str, Any]:
+        """Analyze the structure of code."""
+        return CodeAnalyzer.analyze_all(code)[2]
     
     @staticmethod
     def suggest_improvements(code: str) -> List[str]:
         """Suggest code improvements."""
-        suggestions = []
-        
-        try:
-            tree = ast.parse(code)
-            
-            # Check for common issues
-            has_docstrings = False
-            function_count = 0
-            long_functions = []
-            
-            for node in ast.walk(tree):
-                if isinstance(node, ast.FunctionDef):
-                    function_count += 1
-                    
-                    # Check for docstring
-                    if (node.body and 
-                        isinstance(node.body[0], ast.Expr) and 
-                        isinstance(node.body[0].value, ast.Constant) and 
-                        isinstance(node.body[0].value.value, str)):
-                        has_docstrings = True
-                    
-                    # Check function length
-                    if len(node.body) > 20:
-                        long_functions.append(node.name)
-            
-            # Generate suggestions
-            if function_count > 0 and not has_docstrings:
-                suggestions.append("Consider adding docstrings to your functions")
-            
-            if long_functions:
-                suggestions.append(f"Consider breaking down long functions: {', '.join(long_functions)}")
-            
-            # Check for hardcoded values
-            if any(char.isdigit() for char in code) and 'range(' not in code:
-                suggestions.append("Consider using named constants instead of magic numbers")
-            
-            # Check for repeated code patterns
-            lines = [line.strip() for line in code.split('\n') if line.strip()]
-            if len(lines) != len(set(lines)):
-                suggestions.append("Consider extracting repeated code into functions")
-            
-        except:
-            pass
-        
-        return suggestions
+        return CodeAnalyzer.analyze_all(code)[3]
+
+analyze_all = CodeAnalyzer.analyze_all
 
 # Global code executor
 safe_executor = SafeExecutor()
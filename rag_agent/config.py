@@ -3,19 +3,57 @@ Configuration management for the RAG Agent.
 Handles settings persistence, model detection, and system optimization.
 """
 
+import hashlib
 import json
 import os
 import platform
 import psutil
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
 from typing import Dict, List, Optional, Any
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, fields
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Common LM Studio ports
+_LM_STUDIO_PORTS = [1234, 1235, 1236]
+
+# (name, url, timeout) for each local server probed at startup
+_LOCAL_PROBES = [("ollama", "http://localhost:11434/api/tags", 5)] + [
+    (f"lm_{port}", f"http://localhost:{port}/v1/models", 2) for port in _LM_STUDIO_PORTS
+]
+
+def _make_session() -> requests.Session:
+    """Pooled session for local probes; no retries so failed probes return fast."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=0))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Shared by every probe so repeated availability refreshes reuse sockets
+_SESSION = _make_session()
+
+def _probe_json(url: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """GET a local endpoint, returning its JSON body or None if unreachable."""
+    try:
+        response = _SESSION.get(url, timeout=timeout)
+        if response.status_code == 200:
+            return response.json()
+    except Exception:
+        pass
+    return None
+
+@dataclass(slots=True)
 class ModelConfig:
     """Configuration for a single AI model."""
     name: str
@@ -55,12 +93,16 @@ class AppConfig:
         if self.models is None:
             self.models = {}
 
+_MODEL_FIELDS = tuple(f.name for f in fields(ModelConfig))
+_APP_FIELDS = tuple(f.name for f in fields(AppConfig))
+
 class ConfigManager:
     """Manages application configuration and model detection."""
     
     def __init__(self, config_path: str = "config.json"):
         self.config_path = Path(config_path)
         self.config = AppConfig()
+        self._last_hash: Optional[bytes] = None
         self._ensure_data_directories()
         self.load_config()
         self._detect_system_info()
@@ -102,23 +144,38 @@ class ConfigManager:
     def save_config(self):
         """Save current configuration to file."""
         try:
-            config_dict = asdict(self.config)
-            # Convert ModelConfig objects to dicts
-            if 'models' in config_dict and config_dict['models']:
-                models_dict = {}
-                for name, model in config_dict['models'].items():
-                    if isinstance(model, ModelConfig):
-                        models_dict[name] = asdict(model)
-                    else:
-                        models_dict[name] = model
-                config_dict['models'] = models_dict
-                
-            with open(self.config_path, 'w') as f:
-                json.dump(config_dict, f, indent=2)
+            if orjson is not None:
+                # orjson serializes the nested dataclasses natively
+                data = orjson.dumps(self.config, option=orjson.OPT_INDENT_2)
+            else:
+                config_dict = self._to_dict()
+                data = json.dumps(config_dict, indent=2, ensure_ascii=False).encode()
+            
+            # Skip the write when nothing changed since the last save
+            digest = hashlib.blake2b(data).digest()
+            if digest == self._last_hash and self.config_path.exists():
+                return
+            
+            # Write to a temp file and swap it in so a crash never leaves a partial config
+            tmp_path = self.config_path.with_suffix('.json.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.config_path)
+            self._last_hash = digest
             logger.info(f"Configuration saved to {self.config_path}")
         except Exception as e:
             logger.error(f"Error saving config: {e}")
             
+    def _to_dict(self) -> Dict[str, Any]:
+        """Shallow field-by-field dict of the config, without asdict's deep copy."""
+        config_dict = {name: getattr(self.config, name) for name in _APP_FIELDS}
+        if config_dict['models']:
+            config_dict['models'] = {
+                key: {name: getattr(model, name) for name in _MODEL_FIELDS}
+                for key, model in config_dict['models'].items()
+            }
+        return config_dict
+        
     def _create_default_config(self):
         """Create default configuration with detected models."""
         self.config = AppConfig()
@@ -144,40 +201,46 @@ class ConfigManager:
         """Detect available AI models (local and cloud)."""
         self.config.models = {}
         
+        # Probe Ollama and the LM Studio ports concurrently: startup waits for the
+        # slowest probe rather than the sum of all timeouts
+        with ThreadPoolExecutor(max_workers=len(_LOCAL_PROBES)) as pool:
+            results = dict(zip(
+                (name for name, _, _ in _LOCAL_PROBES),
+                pool.map(lambda probe: _probe_json(probe[1], probe[2]), _LOCAL_PROBES),
+            ))
+        
         # Check Ollama
-        self._check_ollama()
+        self._populate_ollama(results['ollama'])
         
         # Check LM Studio
-        self._check_lm_studio()
+        self._populate_lm_studio({port: results[f"lm_{port}"] for port in _LM_STUDIO_PORTS})
         
         # Add cloud model templates (user needs to add API keys)
         self._add_cloud_model_templates()
         
-    def _check_ollama(self):
-        """Check if Ollama is available and get models."""
+    def _populate_ollama(self, data: Optional[Dict[str, Any]]):
+        """Register Ollama models from its /api/tags response."""
         try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                if 'models' in data:
-                    for model in data['models']:
-                        model_name = f"ollama_{model['name']}"
-                        self.config.models[model_name] = ModelConfig(
-                            name=model['name'],
-                            type="ollama",
-                            endpoint="http://localhost:11434",
-                            model_id=model['name'],
-                            is_available=True
-                        )
-                    logger.info(f"Found {len(data['models'])} Ollama models")
-                else:
-                    # Ollama is running but no models
-                    self._add_ollama_template()
-            else:
-                self._add_ollama_template()
-        except:
-            self._add_ollama_template()
+            if data and 'models' in data:
+                found = {
+                    f"ollama_{model['name']}": ModelConfig(
+                        name=model['name'],
+                        type="ollama",
+                        endpoint="http://localhost:11434",
+                        model_id=model['name'],
+                        is_available=True
+                    )
+                    for model in data['models']
+                }
+                self.config.models.update(found)
+                logger.info(f"Found {len(found)} Ollama models")
+                return
+        except Exception as e:
+            logger.error(f"Unexpected Ollama response: {e}")
             
+        # Ollama is not running, has no models, or answered with unexpected JSON
+        self._add_ollama_template()
+        
     def _add_ollama_template(self):
         """Add Ollama template for manual configuration."""
         self.config.models["ollama_template"] = ModelConfig(
@@ -187,33 +250,29 @@ class ConfigManager:
             is_available=False
         )
         
-    def _check_lm_studio(self):
-        """Check if LM Studio is available."""
-        try:
-            # Common LM Studio ports
-            ports = [1234, 1235, 1236]
-            for port in ports:
-                try:
-                    response = requests.get(f"http://localhost:{port}/v1/models", timeout=2)
-                    if response.status_code == 200:
-                        data = response.json()
-                        if 'data' in data:
-                            for model in data['data']:
-                                model_name = f"lm_studio_{model['id']}"
-                                self.config.models[model_name] = ModelConfig(
-                                    name=model['id'],
-                                    type="lm_studio",
-                                    endpoint=f"http://localhost:{port}/v1",
-                                    model_id=model['id'],
-                                    is_available=True
-                                )
-                            logger.info(f"Found LM Studio on port {port}")
-                            return
-                except:
-                    continue
-        except:
-            pass
-            
+    def _populate_lm_studio(self, responses: Dict[int, Optional[Dict[str, Any]]]):
+        """Register models from the first LM Studio port that answered."""
+        for port in _LM_STUDIO_PORTS:
+            data = responses.get(port)
+            try:
+                if data and 'data' in data:
+                    found = {
+                        f"lm_studio_{model['id']}": ModelConfig(
+                            name=model['id'],
+                            type="lm_studio",
+                            endpoint=f"http://localhost:{port}/v1",
+                            model_id=model['id'],
+                            is_available=True
+                        )
+                        for model in data['data']
+                    }
+                    self.config.models.update(found)
+                    logger.info(f"Found LM Studio on port {port}")
+                    return
+            except Exception as e:
+                # Try the next port, as a server that did not answer would
+                logger.error(f"Unexpected LM Studio response on port {port}: {e}")
+                
         # Add template if not found
         self.config.models["lm_studio_template"] = ModelConfig(
             name="LM Studio (Not Running)",
@@ -3,428 +3,303 @@ Document ingestion pipeline: parsing, chunking, embedding, and storing.
 Handles multiple document formats and integrates with vector store.
 """
 
+import io
 import os
+import json
+import sqlite3
 import hashlib
+import threading
 import mimetypes
+import multiprocessing
+from array import array
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Iterable, List, Dict, Any, Optional, Tuple, Union
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree.ElementTree import iterparse
+import zipfile
 import logging
+import importlib
+from functools import lru_cache
 
-# Document parsing imports
-import pandas as pd
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema import Document
+# Parser backends are imported on first use so that loading this module (and
+# hashing or reading plain text) does not pay for pandas, pyarrow or pypdf
+@lru_cache(maxsize=None)
+def _optional_module(name: str):
+    """Import an optional dependency on first use, or return None if it is missing."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
 
-# Try to import newer HuggingFace embeddings, fallback to community version
+# LangChain components; the embedding model and vector store are loaded in DocumentIngestion
 try:
-    from langchain_huggingface import HuggingFaceEmbeddings
-except ImportError:
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-
-from langchain_chroma import Chroma
-
-# File type specific parsers
-try:
-    import pypdf
-    from pypdf import PdfReader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain.schema import Document
 except ImportError:
-    pypdf = None
+    # Will be handled gracefully
+    pass
 
-try:
-    import docx2txt
-except ImportError:
-    docx2txt = None
+def _huggingface_embeddings():
+    """HuggingFaceEmbeddings class, preferring the maintained integration over the community one."""
+    module = _optional_module('langchain_huggingface') or _optional_module('langchain_community.embeddings')
+    if module is None:
+        raise ImportError("langchain_huggingface package required for embeddings")
+    return module.HuggingFaceEmbeddings
 
 logger = logging.getLogger(__name__)
 
-class DocumentParser:
-    """Handles parsing of different document types."""
+def _detect_device() -> str:
+    """Pick the fastest available torch device for the embedding model."""
+    try:
+        import torch
+    except ImportError:
+        return 'cpu'
     
-    @staticmethod
-    def parse_text_file(file_path: str) -> str:
-        """Parse plain text files."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except UnicodeDecodeError:
-            # Try with different encoding
-            with open(file_path, 'r', encoding='latin-1') as f:
-                return f.read()
+    if torch.cuda.is_available():
+        return 'cuda'
+    mps = getattr(torch.backends, 'mps', None)
+    if mps is not None and mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+class _QuantizedEmbeddings:
+    """LangChain-compatible embeddings from an int8-quantized ONNX export of the model.
     
-    @staticmethod
-    def parse_pdf(file_path: str) -> str:
-        """Parse PDF files."""
-        if not pypdf:
-            raise ImportError("pypdf package required for PDF parsing. Install with: pip install pypdf")
-        
-        try:
-            reader = PdfReader(file_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            logger.error(f"Error parsing PDF {file_path}: {e}")
-            raise
+    Mean-pools and L2-normalizes like the sentence-transformers pipeline, so vectors
+    stay comparable with the fp32 model used for queries.
+    """
     
-    @staticmethod
-    def parse_docx(file_path: str) -> str:
-        """Parse Word documents."""
-        if not docx2txt:
-            raise ImportError("docx2txt package required for Word parsing. Install with: pip install docx2txt")
+    def __init__(self, model_name: str, cache_dir: str, batch_size: int = 64):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
         
-        try:
-            return docx2txt.process(file_path)
-        except Exception as e:
-            logger.error(f"Error parsing DOCX {file_path}: {e}")
-            raise
-    
-    @staticmethod
-    def parse_csv(file_path: str) -> str:
-        """Parse CSV files."""
-        try:
-            df = pd.read_csv(file_path)
-            # Convert to a readable text format
-            return f"CSV File Content:\n{df.to_string()}"
-        except Exception as e:
-            logger.error(f"Error parsing CSV {file_path}: {e}")
-            raise
-    
-    @staticmethod
-    def parse_excel(file_path: str) -> str:
-        """Parse Excel files."""
-        try:
-            # Read all sheets
-            excel_file = pd.ExcelFile(file_path)
-            content = "Excel File Content:\n"
-            
-            for sheet_name in excel_file.sheet_names:
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
-                content += f"\n--- Sheet: {sheet_name} ---\n"
-                content += df.to_string() + "\n"
+        export_dir = Path(cache_dir) / model_name.replace('/', '__')
+        quantized_file = "model_quantized.onnx"
+        if not (export_dir / quantized_file).exists():
+            # One-off export and dynamic int8 quantization, reused on later starts
+            logger.info(f"Exporting {model_name} to int8 ONNX in {export_dir}")
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            model.save_pretrained(export_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+            ORTQuantizer.from_pretrained(model).quantize(
+                save_dir=export_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
             
-            return content
-        except Exception as e:
-            logger.error(f"Error parsing Excel {file_path}: {e}")
-            raise
-    
-    @classmethod
-    def parse_file(cls, file_path: str) -> str:
-        """Parse a file based on its extension."""
-        file_path = Path(file_path)
-        extension = file_path.suffix.lower()
-        
-        parsers = {
-            '.txt': cls.parse_text_file,
-            '.md': cls.parse_text_file,
-            '.py': cls.parse_text_file,
-            '.js': cls.parse_text_file,
-            '.html': cls.parse_text_file,
-            '.css': cls.parse_text_file,
-            '.json': cls.parse_text_file,
-            '.xml': cls.parse_text_file,
-            '.yaml': cls.parse_text_file,
-            '.yml': cls.parse_text_file,
-            '.pdf': cls.parse_pdf,
-            '.docx': cls.parse_docx,
-            '.csv': cls.parse_csv,
-            '.xlsx': cls.parse_excel,
-            '.xls': cls.parse_excel,
-        }
-        
-        parser = parsers.get(extension)
-        if not parser:
-            # Default to text parser for unknown types
-            logger.warning(f"Unknown file type {extension}, treating as text")
-            parser = cls.parse_text_file
-        
-        return parser(str(file_path))
-
-class DocumentIngestion:
-    """Handles document ingestion pipeline."""
-    
-    def __init__(
-        self,
-        vector_store_path: str = "data/vector_store",
-        embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2",
-        chunk_size: int = 500,
-        chunk_overlap: int = 50
-    ):
-        self.vector_store_path = Path(vector_store_path)
-        self.vector_store_path.mkdir(parents=True, exist_ok=True)
-        
-        # Initialize embeddings
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=embedding_model,
-            model_kwargs={'device': 'cpu'},  # Use CPU for compatibility
-            encode_kwargs={'normalize_embeddings': True}
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = os.cpu_count() or 1
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            export_dir, file_name=quantized_file, session_options=session_options
         )
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.encode_kwargs = {'batch_size': batch_size}
         
-        # Initialize text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
         
-        # Initialize or load vector store
-        self.vector_store = self._init_vector_store()
+        batch_size = self.encode_kwargs.get('batch_size', 64)
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[start:start + batch_size], padding=True,
+                                    truncation=True, return_tensors='np')
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs['attention_mask'][..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.tolist())
+        return vectors
         
-        # Document metadata storage
-        self.metadata_file = self.vector_store_path / "document_metadata.json"
-        self.metadata = self._load_metadata()
-    
-    def _init_vector_store(self) -> Chroma:
-        """Initialize the Chroma vector store."""
-        try:
-            # Try to load existing vector store
-            vector_store = Chroma(
-                persist_directory=str(self.vector_store_path),
-                embedding_function=self.embeddings
-            )
-            logger.info(f"Loaded existing vector store from {self.vector_store_path}")
-            return vector_store
-        except Exception as e:
-            logger.info(f"Creating new vector store at {self.vector_store_path}")
-            # Create new vector store
-            vector_store = Chroma(
-                persist_directory=str(self.vector_store_path),
-                embedding_function=self.embeddings
-            )
-            return vector_store
-    
-    def _load_metadata(self) -> Dict[str, Any]:
-        """Load document metadata from file."""
-        if self.metadata_file.exists():
-            try:
-                import json
-                with open(self.metadata_file, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Error loading metadata: {e}")
-        return {}
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+        
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+# WordprocessingML tags read by DocumentParser.parse_docx
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_TEXT = _W_NS + "t"
+_W_TAB = _W_NS + "tab"
+_W_BREAKS = frozenset({_W_NS + "br", _W_NS + "cr"})
+_W_PARAGRAPH = _W_NS + "p"
+
+def _docx_parts(names: List[str]) -> List[str]:
+    """Text-bearing parts of a .docx in reading order: headers, body, notes, footers."""
+    def numbered(prefix: str) -> List[str]:
+        matches = [n for n in names if n.startswith(prefix) and n.endswith('.xml') and n[len(prefix):-4].isdigit()]
+        return sorted(matches, key=lambda n: int(n[len(prefix):-4]))
     
-    def _save_metadata(self):
-        """Save document metadata to file."""
-        try:
-            import json
-            with open(self.metadata_file, 'w') as f:
-                json.dump(self.metadata, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving metadata: {e}")
+    notes = [n for n in ('word/footnotes.xml', 'word/endnotes.xml') if n in names]
+    return numbered('word/header') + ['word/document.xml'] + notes + numbered('word/footer')
+
+def _read_wml_text(f, parts: List[str]) -> None:
+    """Stream one WordprocessingML part, appending its text runs and breaks to parts."""
+    for _, element in iterparse(f, events=('end',)):
+        tag = element.tag
+        if tag == _W_TEXT:
+            if element.text:
+                parts.append(element.text)
+        elif tag == _W_TAB:
+            parts.append("\t")
+        elif tag in _W_BREAKS:
+            parts.append("\n")
+        elif tag == _W_PARAGRAPH:
+            parts.append("\n\n")
+            element.clear()  # keep memory flat on large documents
+
+class _CachedEmbeddings:
+    """Embeddings wrapper that only runs the model on chunks it has not seen before.
     
-    def _get_file_hash(self, file_path: str) -> str:
-        """Generate hash for file content."""
-        hasher = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hasher.update(chunk)
-        return hasher.hexdigest()
+    Vectors are stored in a local SQLite table keyed by a digest of the model key
+    (model name plus backend and precision) and chunk text, so duplicate chunks
+    within a batch and across documents (licenses, headers, boilerplate) are
+    embedded once.
+    """
     
-    def ingest_document(
-        self,
-        file_path: str,
-        original_name: Optional[str] = None
-    ) -> Dict[str, Any]:
-        """
-        Ingest a document into the vector store.
+    def __init__(self, inner, model_key: str, db_path: str):
+        self.inner = inner
+        self._model_key = model_key.encode() + b"\0"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vec BLOB)")
         
-        Args:
-            file_path: Path to the file to ingest
-            original_name: Original filename (for temp files)
-            
-        Returns:
-            Dictionary with ingestion results
-        """
-        file_path = Path(file_path)
-        document_name = original_name or file_path.name
+    @property
+    def encode_kwargs(self) -> Dict[str, Any]:
+        return self.inner.encode_kwargs
         
-        try:
-            # Check if file exists
-            if not file_path.exists():
-                raise FileNotFoundError(f"File not found: {file_path}")
-            
-            # Get file info
-            file_size = file_path.stat().st_size
-            file_hash = self._get_file_hash(str(file_path))
-            
-            # Check if already processed
-            if file_hash in self.metadata:
-                logger.info(f"Document {document_name} already processed (same hash)")
-                return {
-                    "status": "skipped",
-                    "message": "Document already exists",
-                    "document_name": document_name
-                }
-            
-            # Parse document
-            logger.info(f"Parsing document: {document_name}")
-            content = DocumentParser.parse_file(str(file_path))
-            
-            if not content.strip():
-                raise ValueError("Document appears to be empty or could not be parsed")
-            
-            # Split into chunks
-            logger.info(f"Splitting document into chunks: {document_name}")
-            chunks = self.text_splitter.split_text(content)
-            
-            # Create Document objects with metadata
-            documents = []
-            for i, chunk in enumerate(chunks):
-                doc = Document(
-                    page_content=chunk,
-                    metadata={
-                        "source": document_name,
-                        "chunk_id": i,
-                        "total_chunks": len(chunks),
-                        "file_hash": file_hash,
-                        "file_size": file_size,
-                        "ingestion_time": datetime.now().isoformat(),
-                        "file_type": file_path.suffix.lower()
-                    }
+    def _key(self, text: str) -> bytes:
+        return hashlib.blake2b(self._model_key + text.encode(), digest_size=16).digest()
+        
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        unique = list(dict.fromkeys(keys))
+        vectors = {}
+        
+        # Look up every distinct chunk, a bounded number of parameters per query
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE hash IN ({','.join('?' * len(batch))})", batch
                 )
-                documents.append(doc)
-            
-            # Add to vector store
-            logger.info(f"Adding {len(documents)} chunks to vector store")
-            self.vector_store.add_documents(documents)
-            
-            # Save document metadata
-            self.metadata[file_hash] = {
-                "document_name": document_name,
-                "file_size": file_size,
-                "chunk_count": len(chunks),
-                "ingestion_time": datetime.now().isoformat(),
-                "file_type": file_path.suffix.lower(),
-                "content_preview": content[:200] + "..." if len(content) > 200 else content
-            }
-            
-            self._save_metadata()
-            
-            # Persist vector store
-            self.vector_store.persist()
-            
-            logger.info(f"Successfully ingested document: {document_name}")
-            
-            return {
-                "status": "success",
-                "message": f"Successfully processed {document_name}",
-                "document_name": document_name,
-                "chunk_count": len(chunks),
-                "file_size": file_size
-            }
+                for key, blob in rows:
+                    vectors[key] = array('f', blob).tolist()
+                    
+        misses = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in misses:
+                misses[key] = text
+                
+        if misses:
+            vectors.update(self._embed_pipelined(list(misses), list(misses.values())))
             
-        except Exception as e:
-            logger.error(f"Error ingesting document {document_name}: {e}")
-            return {
-                "status": "error",
-                "message": f"Error processing {document_name}: {str(e)}",
-                "document_name": document_name
-            }
-    
-    def ingest_multiple_documents(self, file_paths: List[str]) -> List[Dict[str, Any]]:
-        """Ingest multiple documents."""
-        results = []
-        for file_path in file_paths:
-            result = self.ingest_document(file_path)
-            results.append(result)
-        return results
-    
-    def get_document_stats(self) -> Dict[str, Any]:
-        """Get statistics about ingested documents."""
-        total_documents = len(self.metadata)
-        total_chunks = sum(doc.get("chunk_count", 0) for doc in self.metadata.values())
-        total_size = sum(doc.get("file_size", 0) for doc in self.metadata.values())
-        
-        # Get file type distribution
-        file_types = {}
-        for doc in self.metadata.values():
-            file_type = doc.get("file_type", "unknown")
-            file_types[file_type] = file_types.get(file_type, 0) + 1
-        
-        return {
-            "total_documents": total_documents,
-            "total_chunks": total_chunks,
-            "total_size_bytes": total_size,
-            "total_size_mb": round(total_size / (1024 * 1024), 2),
-            "file_types": file_types,
-            "documents": list(self.metadata.values())
-        }
+        logger.info(f"Embedded {len(misses)} of {len(texts)} chunks; the rest came from the cache")
+        return [vectors[key] for key in keys]
+        
+    def _embed_pipelined(self, keys: List[bytes], texts: List[str]):
+        """Embed texts in slices, caching one slice while the model runs the next.
+        
+        The forward pass releases the GIL, so converting and writing finished
+        vectors to SQLite overlaps with the model instead of idling it.
+        """
+        step = max(self.encode_kwargs.get('batch_size', 64), 1) * 4
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(self.inner.embed_documents, texts[:step])
+            for start in range(0, len(texts), step):
+                embedded = pending.result()
+                if start + step < len(texts):
+                    pending = pool.submit(self.inner.embed_documents, texts[start + step:start + 2 * step])
+                batch_keys = keys[start:start + step]
+                # Misses go through float32 like cache hits, so a chunk's vector never
+                # depends on whether it was cached
+                rounded = [array('f', vector) for vector in embedded]
+                with self._lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                        [(key, vector.tobytes()) for key, vector in zip(batch_keys, rounded)]
+                    )
+                    self._db.commit()
+                yield from zip(batch_keys, (vector.tolist() for vector in rounded))
+        
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
+        
+    def clear(self):
+        """Drop every cached vector and reclaim the file space."""
+        with self._lock:
+            self._db.execute("DELETE FROM embeddings")
+            self._db.commit()
+            self._db.execute("VACUUM")
+
+def _detect_encoding(sample: bytes) -> str:
+    """Best-guess encoding for non-UTF-8 text, falling back to latin-1."""
+    charset_normalizer = _optional_module('charset_normalizer')
+    if not charset_normalizer:
+        return 'latin-1'
     
-    def remove_document(self, file_hash: str) -> bool:
-        """Remove a document from the vector store."""
-        try:
-            if file_hash in self.metadata:
-                # Note: Chroma doesn't have easy document removal by metadata
-                # This would require more complex implementation
-                # For now, we'll just remove from metadata
-                del self.metadata[file_hash]
-                self._save_metadata()
-                logger.info(f"Removed document metadata for hash: {file_hash}")
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"Error removing document: {e}")
-            return False
+    matches = charset_normalizer.from_bytes(sample)
+    best = matches.best()
+    if not best:
+        return 'latin-1'
     
-    def clear_all_documents(self):
-        """Clear all documents from the vector store."""
-        try:
-            # Delete the entire vector store directory and recreate
-            import shutil
-            if self.vector_store_path.exists():
-                shutil.rmtree(self.vector_store_path)
-            
-            # Recreate directory and vector store
-            self.vector_store_path.mkdir(parents=True, exist_ok=True)
-            self.vector_store = self._init_vector_store()
-            
-            # Clear metadata
-            self.metadata = {}
-            self._save_metadata()
-            
-            logger.info("Cleared all documents from vector store")
-        except Exception as e:
-            logger.error(f"Error clearing documents: {e}")
-            raise
-
-import os
-import hashlib
-import mimetypes
-from pathlib import Path
-from typing import List, Dict, Any, Optional
-from datetime import datetime
-import logging
-
-# Document parsers
-try:
-    import pypdf
-except ImportError:
-    pypdf = None
+    # Detection mixes up single-byte Western code pages on short samples;
+    # prefer Windows-1252 whenever it decodes about as cleanly as the winner
+    for match in matches:
+        if match.encoding == 'cp1252' and match.chaos <= best.chaos + 0.05:
+            return 'cp1252'
+    return best.encoding
 
-try:
-    import docx2txt
-except ImportError:
-    docx2txt = None
+def _table_to_text(table) -> str:
+    """Render an Arrow table as CSV text using Arrow's native writer."""
+    buf = io.BytesIO()
+    _optional_module('pyarrow.csv').write_csv(table, buf)
+    return buf.getvalue().decode('utf-8')
 
-try:
-    import pandas as pd
-except ImportError:
-    pd = None
+def _frame_to_text(df) -> str:
+    """Render a DataFrame as CSV text, via Arrow when it is available."""
+    pa = _optional_module('pyarrow')
+    if pa and _optional_module('pyarrow.csv'):
+        try:
+            return _table_to_text(pa.Table.from_pandas(df, preserve_index=False))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # Mixed-type object columns Arrow can't infer; pandas still can
+            pass
+    return df.to_csv(index=False)
 
-# LangChain components
-try:
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain.schema import Document
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-    from langchain_chroma import Chroma
-except ImportError:
-    # Will be handled gracefully
-    pass
+def _parse_worker(file_path: str) -> str:
+    """Pool entry point: parse one file without the ingestion instance."""
+    suffix = Path(file_path).suffix
+    parse = DocumentIngestion._PARSERS.get(suffix.lower())
+    if not parse:
+        raise ValueError(f"Unsupported file type: {suffix}")
+    return parse(file_path)
 
-logger = logging.getLogger(__name__)
+def _parse_many(file_paths: List[str]) -> List[Union[str, Exception]]:
+    """Parse files in parallel, returning each file's text or the exception it raised.
+    
+    Parsing is CPU-bound pure Python, so it runs in worker processes; if a process
+    pool can't be used here the same work runs on threads instead. Workers are
+    spawned rather than forked: forking the threaded Streamlit server can copy
+    locks held by other threads and deadlock the child.
+    """
+    def collect(pool) -> List[Union[str, Exception]]:
+        futures = [pool.submit(_parse_worker, path) for path in file_paths]
+        return [f.exception() or f.result() for f in futures]
+    
+    workers = min(len(file_paths), os.cpu_count() or 1)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = collect(pool)
+        if not any(isinstance(r, BrokenProcessPool) for r in results):
+            return results
+    except (OSError, BrokenProcessPool) as e:
+        logger.warning(f"Process pool unavailable, parsing on threads: {e}")
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return collect(pool)
 
 class DocumentParser:
     """Handles parsing of various document formats."""
@@ -432,40 +307,47 @@ class DocumentParser:
     @staticmethod
     def parse_text(file_path: str) -> str:
         """Parse plain text file."""
+        # Read the bytes once; a failed UTF-8 decode no longer re-reads the file
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            text = data.decode('utf-8')
         except UnicodeDecodeError:
-            # Try with different encoding
-            with open(file_path, 'r', encoding='latin-1') as f:
-                return f.read()
+            text = data.decode(_detect_encoding(data[:65536]), errors='replace')
+        
+        # Match text-mode universal newlines
+        return text.replace('\r\n', '\n').replace('\r', '\n')
                 
     @staticmethod
     def parse_pdf(file_path: str) -> str:
         """Parse PDF file."""
+        pypdf = _optional_module('pypdf')
         if not pypdf:
             raise ImportError("pypdf package required for PDF parsing")
             
-        text = ""
         try:
+            # Pages are extracted in order: pypdf holds the GIL and its reader is not
+            # thread-safe, so parallelism comes from _parse_many's per-file processes
             with open(file_path, 'rb') as f:
-                pdf_reader = pypdf.PdfReader(f)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+                texts = [page.extract_text() or "" for page in pypdf.PdfReader(f).pages]
         except Exception as e:
             logger.error(f"Error parsing PDF {file_path}: {e}")
             raise
             
-        return text
+        return "".join(text + "\n" for text in texts)
         
     @staticmethod 
     def parse_docx(file_path: str) -> str:
         """Parse Word document."""
-        if not docx2txt:
-            raise ImportError("docx2txt package required for DOCX parsing")
-            
         try:
-            return docx2txt.process(file_path)
+            # Stream each part, keeping only text runs and paragraph breaks
+            parts = []
+            with zipfile.ZipFile(file_path) as archive:
+                for name in _docx_parts(archive.namelist()):
+                    with archive.open(name) as f:
+                        _read_wml_text(f, parts)
+            return "".join(parts).strip()
         except Exception as e:
             logger.error(f"Error parsing DOCX {file_path}: {e}")
             raise
@@ -473,13 +355,22 @@ class DocumentParser:
     @staticmethod
     def parse_csv(file_path: str) -> str:
         """Parse CSV file."""
+        pacsv = _optional_module('pyarrow.csv')
+        if pacsv:
+            try:
+                # Multithreaded C++ parser and writer; no rows pass through Python
+                return _table_to_text(pacsv.read_csv(file_path))
+            except Exception as e:
+                logger.error(f"Error parsing CSV {file_path}: {e}")
+                raise
+                
+        pd = _optional_module('pandas')
         if not pd:
-            raise ImportError("pandas package required for CSV parsing")
+            raise ImportError("pyarrow or pandas package required for CSV parsing")
             
         try:
             df = pd.read_csv(file_path)
-            # Convert to readable text format
-            return df.to_string(index=False)
+            return _frame_to_text(df)
         except Exception as e:
             logger.error(f"Error parsing CSV {file_path}: {e}")
             raise
@@ -487,18 +378,22 @@ class DocumentParser:
     @staticmethod
     def parse_excel(file_path: str) -> str:
         """Parse Excel file."""
+        pd = _optional_module('pandas')
         if not pd:
             raise ImportError("pandas package required for Excel parsing")
             
+        # Rust-backed reader for spreadsheets; pandas falls back to openpyxl without it
+        engine = 'calamine' if _optional_module('python_calamine') else None
+        
         try:
             # Read all sheets
-            excel_file = pd.ExcelFile(file_path)
+            excel_file = pd.ExcelFile(file_path, engine=engine)
             text_parts = []
             
             for sheet_name in excel_file.sheet_names:
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
+                df = excel_file.parse(sheet_name)
                 text_parts.append(f"Sheet: {sheet_name}\n")
-                text_parts.append(df.to_string(index=False))
+                text_parts.append(_frame_to_text(df))
                 text_parts.append("\n\n")
                 
             return "".join(text_parts)
@@ -528,10 +423,21 @@ class DocumentIngestion:
         '.xls': 'excel'
     }
     
+    # Extension -> parser function, resolved once at class-definition time
+    _PARSERS = {
+        ext: getattr(DocumentParser, f"parse_{file_type}")
+        for ext, file_type in SUPPORTED_EXTENSIONS.items()
+    }
+    
     def __init__(self, vector_store_path: str = "data/vector_store", 
-                 embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+                 embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 device: Optional[str] = None, batch_size: Optional[int] = None,
+                 use_fast_splitter: bool = True, quantize: bool = False):
         self.vector_store_path = vector_store_path
         self.embedding_model_name = embedding_model
+        self.device = device or _detect_device()
+        # GPUs amortize kernel launches and host-to-device copies over larger batches
+        self.batch_size = batch_size or (128 if self.device == 'cuda' else 64)
         self.parser = DocumentParser()
         
         # Initialize text splitter for chunking
@@ -542,25 +448,70 @@ class DocumentIngestion:
             separators=["\n\n", "\n", ". ", " ", ""]
         )
         
+        # Rust splitter when installed; the LangChain splitter above is the fallback
+        self.fast_splitter = None
+        rust_splitter = _optional_module('semantic_text_splitter') if use_fast_splitter else None
+        if rust_splitter is not None:
+            try:
+                self.fast_splitter = rust_splitter.TextSplitter(capacity=500, overlap=50)
+            except Exception as e:
+                logger.warning(f"Falling back to LangChain text splitter: {e}")
+        
         # Initialize embedding model
-        try:
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=embedding_model,
-                model_kwargs={'device': 'cpu'}  # Use CPU for cross-platform compatibility
-            )
-        except Exception as e:
-            logger.error(f"Error initializing embedding model: {e}")
-            self.embeddings = None
+        self.embeddings = None
+        if quantize:
+            try:
+                self.embeddings = _QuantizedEmbeddings(
+                    embedding_model, os.path.join(vector_store_path, "onnx_int8"), self.batch_size
+                )
+            except Exception as e:
+                logger.warning(f"Int8 ONNX embeddings unavailable, using the default model: {e}")
+                
+        if self.embeddings is None:
+            try:
+                model_kwargs = {'device': self.device}
+                if self.device == 'cuda':
+                    # Half precision halves weight memory and per-batch transfer size
+                    model_kwargs['model_kwargs'] = {'torch_dtype': 'float16'}
+                self.embeddings = _huggingface_embeddings()(
+                    model_name=embedding_model,
+                    model_kwargs=model_kwargs,
+                    encode_kwargs={'batch_size': self.batch_size}
+                )
+            except Exception as e:
+                logger.error(f"Error initializing embedding model: {e}")
+                self.embeddings = None
+                
+        # Reuse vectors for chunks that were embedded before; the key names the
+        # backend and precision so int8/fp16/fp32 vectors never stand in for each other
+        if self.embeddings is not None:
+            if isinstance(self.embeddings, _QuantizedEmbeddings):
+                variant = "onnx:int8"
+            else:
+                variant = f"torch:{'float16' if self.device == 'cuda' else 'float32'}"
+            try:
+                os.makedirs(vector_store_path, exist_ok=True)
+                self.embeddings = _CachedEmbeddings(
+                    self.embeddings, f"{embedding_model}|{variant}", os.path.join(vector_store_path, "embed_cache.db")
+                )
+            except Exception as e:
+                logger.warning(f"Embedding cache unavailable: {e}")
             
         # Initialize vector store
         self._init_vector_store()
         
+        # Content hashes of ingested files, replayed from an append-only journal
+        self.index_file = os.path.join(self.vector_store_path, "ingested_files.jsonl")
+        self.ingested = self._load_ingest_index()
+        self._pending_index: List[Dict[str, Any]] = []
+        
     def _init_vector_store(self):
         """Initialize the vector store."""
         try:
             os.makedirs(self.vector_store_path, exist_ok=True)
             
             if self.embeddings:
+                from langchain_chroma import Chroma
                 self.vector_store = Chroma(
                     persist_directory=self.vector_store_path,
                     embedding_function=self.embeddings
@@ -572,6 +523,94 @@ class DocumentIngestion:
             logger.error(f"Error initializing vector store: {e}")
             self.vector_store = None
             
+    def _load_ingest_index(self) -> Dict[str, Dict[str, Any]]:
+        """Replay the ingest journal; later rows override earlier ones."""
+        index = {}
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        if entry.get('deleted'):
+                            index.pop(entry['file_hash'], None)
+                        else:
+                            index[entry['file_hash']] = entry
+            except Exception as e:
+                logger.error(f"Error loading ingest index: {e}")
+        return index
+        
+    def _record(self, entry: Dict[str, Any]):
+        """Apply a journal row in memory and queue it for the next flush."""
+        if entry.get('deleted'):
+            self.ingested.pop(entry['file_hash'], None)
+        else:
+            self.ingested[entry['file_hash']] = entry
+        self._pending_index.append(entry)
+        
+    def flush(self):
+        """Write queued journal rows and persist the vector store, once per batch."""
+        self._flush_index()
+        
+        # Older Chroma wrappers buffer writes until persist(); current ones write through
+        persist = getattr(self.vector_store, 'persist', None)
+        if callable(persist):
+            try:
+                persist()
+            except Exception as e:
+                logger.error(f"Error persisting vector store: {e}")
+                
+    def _flush_index(self):
+        """Append queued journal rows to disk in a single write."""
+        if not self._pending_index:
+            return
+        try:
+            with open(self.index_file, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in self._pending_index))
+            self._pending_index = []
+        except Exception as e:
+            logger.error(f"Error updating ingest index: {e}")
+            
+    def _forget_file(self, file_name: str):
+        """Record tombstones for a deleted file so it can be ingested again."""
+        for file_hash in [h for h, entry in self.ingested.items() if entry['file_name'] == file_name]:
+            self._record({"file_hash": file_hash, "deleted": True})
+        self._flush_index()
+            
+    @classmethod
+    def _stat_and_hash(cls, file_path: str) -> Tuple[int, str]:
+        """Size check and content hash for one file."""
+        file_size = os.path.getsize(file_path)
+        if file_size > 50 * 1024 * 1024:  # 50MB
+            raise ValueError("File too large (max 50MB)")
+        return file_size, cls._get_file_hash(file_path)
+        
+    @staticmethod
+    def _get_file_hash(file_path: str) -> str:
+        """SHA-256 of the file bytes."""
+        with open(file_path, 'rb') as f:
+            if hasattr(hashlib, 'file_digest'):
+                # Python 3.11+: hashed in C with the GIL released
+                return hashlib.file_digest(f, 'sha256').hexdigest()
+            
+            hasher = hashlib.sha256()
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+            return hasher.hexdigest()
+        
+    def _add_documents(self, documents: List[Document]) -> List[str]:
+        """Embed and store chunks, halving the embedding batch size on out-of-memory errors."""
+        while True:
+            try:
+                return self.vector_store.add_documents(documents)
+            except RuntimeError as e:
+                batch_size = self.embeddings.encode_kwargs.get('batch_size', self.batch_size)
+                if 'out of memory' not in str(e).lower() or batch_size <= 1:
+                    raise
+                self.embeddings.encode_kwargs['batch_size'] = batch_size // 2
+                logger.warning(f"Embedding ran out of memory, retrying with batch size {batch_size // 2}")
+            
     def is_supported(self, file_path: str) -> bool:
         """Check if file type is supported."""
         ext = Path(file_path).suffix.lower()
@@ -584,56 +623,79 @@ class DocumentIngestion:
         
     def parse_document(self, file_path: str) -> str:
         """Parse a document based on its type."""
-        file_type = self.get_file_type(file_path)
+        suffix = Path(file_path).suffix
+        parse = self._PARSERS.get(suffix.lower())
         
-        if not file_type:
-            raise ValueError(f"Unsupported file type: {Path(file_path).suffix}")
+        if not parse:
+            raise ValueError(f"Unsupported file type: {suffix}")
             
         try:
-            if file_type == 'text':
-                return self.parser.parse_text(file_path)
-            elif file_type == 'pdf':
-                return self.parser.parse_pdf(file_path)
-            elif file_type == 'docx':
-                return self.parser.parse_docx(file_path)
-            elif file_type == 'csv':
-                return self.parser.parse_csv(file_path)
-            elif file_type == 'excel':
-                return self.parser.parse_excel(file_path)
-            else:
-                raise ValueError(f"Unknown file type: {file_type}")
-                
+            return parse(file_path)
         except Exception as e:
             logger.error(f"Error parsing {file_path}: {e}")
             raise
             
-    def chunk_text(self, text: str, file_name: str) -> List[Document]:
-        """Split text into chunks."""
+    def _split(self, text: str, file_name: str,
+               file_hash: Optional[str] = None) -> Tuple[List[str], Dict[str, Any]]:
+        """Split text into chunk strings plus the metadata shared by all of them."""
         try:
             # Split text into chunks
-            chunks = self.text_splitter.split_text(text)
-            
-            # Create Document objects with metadata
-            documents = []
-            for i, chunk in enumerate(chunks):
-                doc = Document(
-                    page_content=chunk,
-                    metadata={
-                        "file_name": file_name,
-                        "chunk_id": i,
-                        "total_chunks": len(chunks),
-                        "upload_date": datetime.now().isoformat(),
-                        "file_hash": hashlib.md5(text.encode()).hexdigest()[:8]
-                    }
-                )
-                documents.append(doc)
-                
-            return documents
+            if self.fast_splitter is not None:
+                chunks = self.fast_splitter.chunks(text)
+            else:
+                chunks = self.text_splitter.split_text(text)
+            
+            # Per-document values are computed once; each chunk only adds its id
+            base = {
+                "file_name": file_name,
+                "total_chunks": len(chunks),
+                "upload_date": datetime.now().isoformat(),
+                "file_hash": (file_hash or hashlib.md5(text.encode()).hexdigest())[:8]
+            }
+            return chunks, base
             
         except Exception as e:
             logger.error(f"Error chunking text for {file_name}: {e}")
             raise
             
+    @staticmethod
+    def _documents(chunks: List[str], base: Dict[str, Any], start: int = 0) -> List[Document]:
+        """Wrap chunk strings in Documents, numbering them from start."""
+        return [
+            Document(page_content=chunk, metadata={**base, "chunk_id": i})
+            for i, chunk in enumerate(chunks, start)
+        ]
+        
+    def chunk_text(self, text: str, file_name: str, file_hash: Optional[str] = None) -> List[Document]:
+        """Split text into chunks."""
+        chunks, base = self._split(text, file_name, file_hash)
+        return self._documents(chunks, base)
+        
+    def _add_chunks(self, chunks: List[str], base: Dict[str, Any]) -> List[str]:
+        """Embed and store one document's chunks a batch at a time.
+        
+        Documents and vectors only exist for the batch in flight, so peak memory
+        no longer grows with document size. A failure removes the batches
+        already stored, leaving no partial document behind.
+        """
+        step = self.batch_size * 4
+        return self._store_batches(
+            self._documents(chunks[start:start + step], base, start)
+            for start in range(0, len(chunks), step)
+        )
+        
+    def _store_batches(self, batches: Iterable[List[Document]]) -> List[str]:
+        """Embed and store batches of Documents; a failure removes the batches already stored."""
+        ids = []
+        try:
+            for documents in batches:
+                ids.extend(self._add_documents(documents))
+        except Exception:
+            if ids:
+                self.vector_store.delete(ids=ids)
+            raise
+        return ids
+            
     def ingest_document(self, file_path: str, file_name: Optional[str] = None) -> Dict[str, Any]:
         """Ingest a single document into the vector store."""
         if not self.vector_store:
@@ -643,10 +705,17 @@ class DocumentIngestion:
             file_name = Path(file_path).name
             
         try:
-            # Check file size (limit to 50MB as per requirements)
-            file_size = os.path.getsize(file_path)
-            if file_size > 50 * 1024 * 1024:  # 50MB
-                raise ValueError("File too large (max 50MB)")
+            # Check file size (limit to 50MB as per requirements), then skip
+            # unchanged files before paying for parsing and embedding
+            file_size, file_hash = self._stat_and_hash(file_path)
+            if file_hash in self.ingested:
+                logger.info(f"Document {file_name} already ingested (same content hash)")
+                return {
+                    "file_name": file_name,
+                    "file_size": file_size,
+                    "status": "skipped",
+                    "message": f"Already ingested as {self.ingested[file_hash]['file_name']}"
+                }
                 
             # Parse document
             logger.info(f"Parsing document: {file_name}")
@@ -655,25 +724,29 @@ class DocumentIngestion:
             if not text.strip():
                 raise ValueError("No text content extracted from document")
                 
-            # Chunk text
+            # Chunk text; the chunks hold everything still needed from it
             logger.info(f"Chunking document: {file_name}")
-            documents = self.chunk_text(text, file_name)
+            chunks, base = self._split(text, file_name, file_hash)
+            del text
             
-            # Add to vector store
-            logger.info(f"Adding {len(documents)} chunks to vector store")
-            ids = self.vector_store.add_documents(documents)
+            # Stream chunks to the vector store in batches
+            logger.info(f"Adding {len(chunks)} chunks to vector store")
+            ids = self._add_chunks(chunks, base)
             
             # Return ingestion summary
             result = {
                 "file_name": file_name,
                 "file_size": file_size,
-                "num_chunks": len(documents),
+                "num_chunks": len(chunks),
                 "chunk_ids": ids,
                 "upload_date": datetime.now().isoformat(),
                 "status": "success"
             }
             
-            logger.info(f"Successfully ingested {file_name}: {len(documents)} chunks")
+            self._record({"file_hash": file_hash, "file_name": file_name, "file_size": file_size})
+            self.flush()
+            
+            logger.info(f"Successfully ingested {file_name}: {len(chunks)} chunks")
             return result
             
         except Exception as e:
@@ -684,6 +757,88 @@ class DocumentIngestion:
                 "error": str(e)
             }
             
+    def ingest_multiple_documents(self, file_paths: List[str],
+                                  file_names: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Ingest several documents: parse them in parallel, then embed their chunks together in batches."""
+        if not self.vector_store:
+            raise RuntimeError("Vector store not initialized")
+            
+        file_names = file_names or [Path(path).name for path in file_paths]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        pending = []  # (index, path, name, hash, size) of files that still need parsing
+        batch_hashes = set()
+        
+        # Read and hash all files concurrently; file_digest releases the GIL
+        with ThreadPoolExecutor(max_workers=min(len(file_paths), 16) or 1) as pool:
+            futures = [pool.submit(self._stat_and_hash, path) for path in file_paths]
+            
+        for i, (file_path, file_name) in enumerate(zip(file_paths, file_names)):
+            try:
+                file_size, file_hash = futures[i].result()
+                if file_hash in self.ingested or file_hash in batch_hashes:
+                    previous = self.ingested.get(file_hash, {}).get('file_name', 'another file in this batch')
+                    results[i] = {
+                        "file_name": file_name,
+                        "file_size": file_size,
+                        "status": "skipped",
+                        "message": f"Already ingested as {previous}"
+                    }
+                    continue
+                    
+                batch_hashes.add(file_hash)
+                pending.append((i, file_path, file_name, file_hash, file_size))
+            except Exception as e:
+                logger.error(f"Error ingesting {file_name}: {e}")
+                results[i] = {"file_name": file_name, "status": "error", "error": str(e)}
+                
+        # Parse in parallel, then chunk every document into one list
+        logger.info(f"Parsing {len(pending)} documents")
+        texts = _parse_many([path for _, path, _, _, _ in pending]) if pending else []
+        all_documents = []
+        chunked = []  # (index, name, hash, size, start, end) slices of all_documents
+        
+        for (i, _, file_name, file_hash, file_size), text in zip(pending, texts):
+            if isinstance(text, Exception) or not text.strip():
+                error = str(text) if isinstance(text, Exception) else "No text content extracted from document"
+                logger.error(f"Error ingesting {file_name}: {error}")
+                results[i] = {"file_name": file_name, "status": "error", "error": error}
+                continue
+                
+            documents = self.chunk_text(text, file_name, file_hash)
+            chunked.append((i, file_name, file_hash, file_size, len(all_documents), len(all_documents) + len(documents)))
+            all_documents.extend(documents)
+            
+        # Batches span documents so small files still fill the embedding batch; a
+        # failure rolls back every batch stored so far
+        try:
+            logger.info(f"Adding {len(all_documents)} chunks from {len(chunked)} documents to vector store")
+            step = self.batch_size * 4
+            ids = self._store_batches(
+                all_documents[start:start + step] for start in range(0, len(all_documents), step)
+            )
+        except Exception as e:
+            logger.error(f"Error adding documents to vector store: {e}")
+            for i, file_name, _, _, _, _ in chunked:
+                results[i] = {"file_name": file_name, "status": "error", "error": str(e)}
+            return results
+            
+        upload_date = datetime.now().isoformat()
+        for i, file_name, file_hash, file_size, start, end in chunked:
+            results[i] = {
+                "file_name": file_name,
+                "file_size": file_size,
+                "num_chunks": end - start,
+                "chunk_ids": ids[start:end],
+                "upload_date": upload_date,
+                "status": "success"
+            }
+            self._record({"file_hash": file_hash, "file_name": file_name, "file_size": file_size})
+            
+        # One journal write and vector store persist for the whole batch
+        self.flush()
+        logger.info(f"Successfully ingested {len(chunked)} of {len(file_paths)} documents")
+        return results
+        
     def ingest_text(self, text: str, title: str = "user_text") -> Dict[str, Any]:
         """Ingest raw text (e.g., from chat input)."""
         if not self.vector_store:
@@ -691,20 +846,20 @@ class DocumentIngestion:
             
         try:
             # Chunk text
-            documents = self.chunk_text(text, title)
+            chunks, base = self._split(text, title)
             
             # Add to vector store  
-            ids = self.vector_store.add_documents(documents)
+            ids = self._add_chunks(chunks, base)
             
             result = {
                 "file_name": title,
-                "num_chunks": len(documents),
+                "num_chunks": len(chunks),
                 "chunk_ids": ids,
                 "upload_date": datetime.now().isoformat(),
                 "status": "success"
             }
             
-            logger.info(f"Successfully ingested text '{title}': {len(documents)} chunks")
+            logger.info(f"Successfully ingested text '{title}': {len(chunks)} chunks")
             return result
             
         except Exception as e:
@@ -768,6 +923,7 @@ class DocumentIngestion:
                     
             if ids_to_delete:
                 self.vector_store.delete(ids=ids_to_delete)
+                self._forget_file(file_name)
                 logger.info(f"Deleted {len(ids_to_delete)} chunks for {file_name}")
                 return True
             else:
@@ -791,6 +947,16 @@ class DocumentIngestion:
                 self.vector_store.delete(ids=results['ids'])
                 logger.info(f"Cleared {len(results['ids'])} chunks from vector store")
                 
+            # Cached vectors are content of the cleared documents too
+            if isinstance(self.embeddings, _CachedEmbeddings):
+                self.embeddings.clear()
+                
+            # Start a fresh journal so cleared files can be ingested again
+            self.ingested = {}
+            self._pending_index = []
+            if os.path.exists(self.index_file):
+                os.remove(self.index_file)
+                
             return True
             
         except Exception as e:
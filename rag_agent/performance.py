@@ -4,22 +4,40 @@ Handles caching, monitoring, and optimization.
 """
 
 import time
+import atexit
+import hashlib
+import weakref
 import functools
 import logging
 import psutil
 import threading
-from typing import Dict, Any, Optional, Callable
+from collections import deque
+from typing import Dict, Any, List, Optional, Callable
 from pathlib import Path
 import json
-from dataclasses import dataclass, asdict
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+_MAX_METRICS = 1000
+_SYSTEM_SAMPLE_TTL = 0.5  # Seconds a psutil sample is reused across operations
+_MINUTE_NS = 60 * 10**9
+_SUMMARY_MINUTES = 60  # Window of per-minute aggregates behind the "last hour" summary
+_FLUSH_INTERVAL = 2.0  # Seconds between background flushes of the metrics log
+
+# Monitors with an open metrics log, flushed by the background thread
+_open_monitors = weakref.WeakSet()
+
 @dataclass
 class PerformanceMetrics:
     """Performance metrics for monitoring."""
-    timestamp: str
+    timestamp: int  # Wall-clock time in nanoseconds since the epoch
     cpu_percent: float
     memory_percent: float
     memory_mb: float
@@ -32,46 +50,129 @@ class PerformanceMetrics:
 class PerformanceMonitor:
     """Monitors system performance and operation metrics."""
     
-    def __init__(self, metrics_file: str = "data/performance_metrics.json"):
+    def __init__(self, metrics_file: str = "data/performance_metrics.jsonl"):
         self.metrics_file = Path(metrics_file)
         self.metrics_file.parent.mkdir(exist_ok=True)
-        self.metrics = []
+        self.metrics = deque(maxlen=_MAX_METRICS)
+        self.revision = 0  # Bumped on every recorded operation
+        self._fh = None  # Append-only metrics log, opened on first write
+        self._sys_cache = (float('-inf'), None)  # (monotonic time, system sample)
+        # (minute, {operation: [count, sum_ms, max_ms, successes, sum_cpu, sum_memory]})
+        self._minute_buckets = deque(maxlen=_SUMMARY_MINUTES)
+        self._lock = threading.Lock()
         self._load_metrics()
     
     def _load_metrics(self):
-        """Load existing metrics from file."""
+        """Load the most recent metrics from the JSONL log."""
         try:
-            if self.metrics_file.exists():
-                with open(self.metrics_file, 'r') as f:
-                    data = json.load(f)
-                    # Keep only last 1000 metrics to prevent file bloat
-                    self.metrics = data[-1000:]
+            if not self.metrics_file.exists():
+                return
+            
+            lines = 0
+            loads = orjson.loads if orjson is not None else json.loads
+            with open(self.metrics_file, 'rb') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = loads(line)
+                        if isinstance(record['timestamp'], str):
+                            # Records written before timestamps were stored as integers
+                            record['timestamp'] = int(datetime.fromisoformat(record['timestamp']).timestamp() * 1e9)
+                        metrics = PerformanceMetrics(**record)
+                        self.metrics.append(metrics)
+                        self._aggregate(metrics)
+                    except (ValueError, TypeError, KeyError):
+                        continue  # Torn or malformed line from an interrupted write
+            
+            # Compact the log once it holds well more than what is kept in memory
+            if lines > 2 * _MAX_METRICS:
+                tmp_file = self.metrics_file.with_suffix('.jsonl.tmp')
+                with open(tmp_file, 'wb') as f:
+                    f.writelines(self._to_line(m) for m in self.metrics)
+                tmp_file.replace(self.metrics_file)
         except Exception as e:
             logger.error(f"Error loading metrics: {e}")
-            self.metrics = []
+            self.metrics.clear()
+            self._minute_buckets.clear()
     
-    def _save_metrics(self):
-        """Save metrics to file."""
+    @staticmethod
+    def _accumulate(operations: Dict[str, List[float]], metrics: PerformanceMetrics):
+        """Fold one record into per-operation running totals."""
+        stats = operations.get(metrics.operation)
+        if stats is None:
+            stats = operations[metrics.operation] = [0, 0.0, 0.0, 0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += metrics.response_time_ms
+        stats[2] = max(stats[2], metrics.response_time_ms)
+        stats[3] += metrics.success
+        stats[4] += metrics.cpu_percent
+        stats[5] += metrics.memory_percent
+    
+    def _aggregate(self, metrics: PerformanceMetrics):
+        """Add a record to the bucket for the minute it was recorded in."""
+        minute = metrics.timestamp // _MINUTE_NS
+        if not self._minute_buckets or self._minute_buckets[-1][0] != minute:
+            self._minute_buckets.append((minute, {}))
+        self._accumulate(self._minute_buckets[-1][1], metrics)
+    
+    @staticmethod
+    def _to_line(metrics: PerformanceMetrics) -> bytes:
+        if orjson is not None:
+            # orjson serializes the flat dataclass directly, newline included
+            return orjson.dumps(metrics, option=orjson.OPT_APPEND_NEWLINE)
+        # The fields are all primitives, so __dict__ can be dumped without asdict's deep copy
+        return (json.dumps(metrics.__dict__, separators=(',', ':')) + '\n').encode()
+    
+    def _save_metrics(self, metrics: PerformanceMetrics):
+        """Append one metrics record to the buffered log."""
         try:
-            with open(self.metrics_file, 'w') as f:
-                json.dump([asdict(m) for m in self.metrics], f, indent=2)
+            with self._lock:
+                if self._fh is None:
+                    self._fh = open(self.metrics_file, 'ab', buffering=64 * 1024)
+                    _open_monitors.add(self)
+                self._fh.write(self._to_line(metrics))
         except Exception as e:
             logger.error(f"Error saving metrics: {e}")
     
-    def record_operation(self, operation: str, start_time: float, success: bool = True, error: str = None):
-        """Record performance metrics for an operation."""
+    def flush(self):
+        """Write buffered metrics records to disk."""
+        try:
+            with self._lock:
+                if self._fh is not None:
+                    self._fh.flush()
+        except Exception as e:
+            logger.error(f"Error flushing metrics: {e}")
+    
+    def _system_sample(self):
+        """CPU, memory and disk readings, resampled at most every _SYSTEM_SAMPLE_TTL seconds."""
+        sampled_at, sample = self._sys_cache
+        now = time.monotonic()
+        if now - sampled_at > _SYSTEM_SAMPLE_TTL:
+            sample = (psutil.cpu_percent(interval=None), psutil.virtual_memory(), psutil.disk_usage('/'))
+            # A single tuple assignment, so concurrent readers never see a torn pair
+            self._sys_cache = (now, sample)
+        return sample
+    
+    def record_operation(self, operation: str, start_time: Optional[float] = None, success: bool = True,
+                         error: str = None, *, start_ns: Optional[int] = None):
+        """Record performance metrics for an operation.
+        
+        Pass either start_ns from time.perf_counter_ns() or a wall-clock start_time
+        from time.time(); the monotonic counter is preferred.
+        """
         try:
             # Get system metrics
-            cpu_percent = psutil.cpu_percent()
-            memory = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
+            cpu_percent, memory, disk = self._system_sample()
             
             # Calculate response time
-            response_time_ms = (time.time() - start_time) * 1000
+            if start_ns is not None:
+                response_time_ms = (time.perf_counter_ns() - start_ns) / 1e6
+            else:
+                response_time_ms = (time.time() - start_time) * 1000
             
             # Create metrics record
             metrics = PerformanceMetrics(
-                timestamp=datetime.now().isoformat(),
+                timestamp=time.time_ns(),
                 cpu_percent=cpu_percent,
                 memory_percent=memory.percent,
                 memory_mb=memory.used / (1024 * 1024),
@@ -82,16 +183,13 @@ class PerformanceMonitor:
                 error_message=error
             )
             
-            # Add to metrics list
-            self.metrics.append(metrics)
-            
-            # Keep only last 1000 metrics
-            if len(self.metrics) > 1000:
-                self.metrics = self.metrics[-1000:]
-            
-            # Save periodically
-            if len(self.metrics) % 10 == 0:
-                threading.Thread(target=self._save_metrics, daemon=True).start()
+            # Add to metrics (the deque drops the oldest past 1000), the running
+            # per-minute aggregates and the log
+            with self._lock:
+                self.metrics.append(metrics)
+                self._aggregate(metrics)
+                self.revision += 1
+            self._save_metrics(metrics)
             
             # Log slow operations
             if response_time_ms > 5000:  # > 5 seconds
@@ -105,124 +203,159 @@ class PerformanceMonitor:
         if not self.metrics:
             return {"message": "No metrics available"}
         
-        # Recent metrics (last hour)
-        recent_cutoff = datetime.now() - timedelta(hours=1)
-        recent_metrics = [
-            m for m in self.metrics 
-            if datetime.fromisoformat(m.timestamp) > recent_cutoff
-        ]
+        # Merge the per-minute aggregates from the last hour; no per-record scan
+        cutoff = time.time_ns() // _MINUTE_NS - _SUMMARY_MINUTES
+        operation_stats: Dict[str, List[float]] = {}
+        with self._lock:
+            for minute, bucket in self._minute_buckets:
+                if minute <= cutoff:
+                    continue
+                for op, stats in bucket.items():
+                    merged = operation_stats.get(op)
+                    if merged is None:
+                        operation_stats[op] = list(stats)
+                        continue
+                    merged[0] += stats[0]
+                    merged[1] += stats[1]
+                    merged[2] = max(merged[2], stats[2])
+                    merged[3] += stats[3]
+                    merged[4] += stats[4]
+                    merged[5] += stats[5]
         
-        if not recent_metrics:
-            recent_metrics = self.metrics[-10:]  # Last 10 if no recent
+        if not operation_stats:
+            # Last 10 if no recent
+            for m in list(self.metrics)[-10:]:
+                self._accumulate(operation_stats, m)
         
         # Calculate statistics
-        avg_response_time = sum(m.response_time_ms for m in recent_metrics) / len(recent_metrics)
-        max_response_time = max(m.response_time_ms for m in recent_metrics)
-        success_rate = sum(1 for m in recent_metrics if m.success) / len(recent_metrics) * 100
+        total = sum(stats[0] for stats in operation_stats.values())
+        avg_response_time = sum(stats[1] for stats in operation_stats.values()) / total
+        max_response_time = max(stats[2] for stats in operation_stats.values())
+        success_rate = sum(stats[3] for stats in operation_stats.values()) / total * 100
         
-        avg_cpu = sum(m.cpu_percent for m in recent_metrics) / len(recent_metrics)
-        avg_memory = sum(m.memory_percent for m in recent_metrics) / len(recent_metrics)
+        avg_cpu = sum(stats[4] for stats in operation_stats.values()) / total
+        avg_memory = sum(stats[5] for stats in operation_stats.values()) / total
         
         # Operation breakdown
-        operations = {}
-        for m in recent_metrics:
-            if m.operation not in operations:
-                operations[m.operation] = {'count': 0, 'avg_time': 0, 'success_rate': 0}
-            operations[m.operation]['count'] += 1
-        
-        # Calculate per-operation stats
-        for op in operations:
-            op_metrics = [m for m in recent_metrics if m.operation == op]
-            operations[op]['avg_time'] = sum(m.response_time_ms for m in op_metrics) / len(op_metrics)
-            operations[op]['success_rate'] = sum(1 for m in op_metrics if m.success) / len(op_metrics) * 100
+        operations = {
+            op: {
+                'count': stats[0],
+                'avg_time': stats[1] / stats[0],
+                'success_rate': stats[3] / stats[0] * 100
+            }
+            for op, stats in operation_stats.items()
+        }
         
         return {
-            "total_operations": len(recent_metrics),
+            "total_operations": total,
             "avg_response_time_ms": round(avg_response_time, 2),
             "max_response_time_ms": round(max_response_time, 2),
             "success_rate_percent": round(success_rate, 2),
             "avg_cpu_percent": round(avg_cpu, 2),
             "avg_memory_percent": round(avg_memory, 2),
             "operations": operations,
-            "time_period": "Last hour" if len(recent_metrics) > 10 else "Recent operations"
+            "time_period": "Last hour" if total > 10 else "Recent operations"
         }
 
 class SimpleCache:
-    """Simple in-memory cache with TTL support."""
+    """Simple in-memory cache with TTL support.
+    
+    Entries are spread over independently locked shards so concurrent readers
+    only contend when their keys land in the same shard.
+    """
+    
+    _SHARDS = 16  # Power of two so a key's shard is a bit mask of its hash
     
     def __init__(self, default_ttl: int = 3600):
-        self.cache: Dict[str, Dict[str, Any]] = {}
+        self._shards: List[Dict[str, Dict[str, Any]]] = [{} for _ in range(self._SHARDS)]
+        self._locks = [threading.Lock() for _ in range(self._SHARDS)]
         self.default_ttl = default_ttl
-        self._lock = threading.Lock()
+    
+    def _shard(self, key: str) -> int:
+        return hash(key) & (self._SHARDS - 1)
     
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache."""
-        with self._lock:
-            if key in self.cache:
-                item = self.cache[key]
-                # Check if expired
-                if time.time() > item['expires']:
-                    del self.cache[key]
-                    return None
-                return item['value']
-            return None
+        index = self._shard(key)
+        shard = self._shards[index]
+        with self._locks[index]:
+            item = shard.get(key)
+            if item is None:
+                return None
+            # Check if expired
+            if time.monotonic() > item['expires']:
+                del shard[key]
+                return None
+            return item['value']
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """Set value in cache with TTL."""
         if ttl is None:
             ttl = self.default_ttl
         
-        with self._lock:
-            self.cache[key] = {
-                'value': value,
-                'expires': time.time() + ttl,
-                'created': time.time()
-            }
+        # Expiry uses the monotonic clock so wall-clock jumps can't revive or drop entries
+        item = {
+            'value': value,
+            'expires': time.monotonic() + ttl,
+            'created': time.time()
+        }
+        index = self._shard(key)
+        with self._locks[index]:
+            self._shards[index][key] = item
     
     def delete(self, key: str) -> bool:
         """Delete key from cache."""
-        with self._lock:
-            if key in self.cache:
-                del self.cache[key]
-                return True
-            return False
+        index = self._shard(key)
+        with self._locks[index]:
+            return self._shards[index].pop(key, None) is not None
     
     def clear(self) -> None:
         """Clear all cache entries."""
-        with self._lock:
-            self.cache.clear()
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                shard.clear()
     
     def cleanup_expired(self) -> int:
         """Remove expired entries and return count."""
-        current_time = time.time()
-        expired_keys = []
+        current_time = time.monotonic()
+        removed = 0
         
-        with self._lock:
-            for key, item in self.cache.items():
-                if current_time > item['expires']:
-                    expired_keys.append(key)
-            
-            for key in expired_keys:
-                del self.cache[key]
+        # Each shard is swept under its own lock, so readers of other shards never wait
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                expired_keys = [key for key, item in shard.items() if current_time > item['expires']]
+                for key in expired_keys:
+                    del shard[key]
+            removed += len(expired_keys)
         
-        return len(expired_keys)
+        return removed
     
     def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics."""
-        with self._lock:
-            total_size = sum(len(str(item['value'])) for item in self.cache.values())
-            return {
-                "total_keys": len(self.cache),
-                "estimated_size_bytes": total_size,
-                "oldest_entry": min((item['created'] for item in self.cache.values()), default=0)
-            }
+        total_keys = 0
+        total_size = 0
+        oldest_entry = None
+        
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                total_keys += len(shard)
+                total_size += sum(len(str(item['value'])) for item in shard.values())
+                shard_oldest = min((item['created'] for item in shard.values()), default=None)
+            if shard_oldest is not None and (oldest_entry is None or shard_oldest < oldest_entry):
+                oldest_entry = shard_oldest
+        
+        return {
+            "total_keys": total_keys,
+            "estimated_size_bytes": total_size,
+            "oldest_entry": oldest_entry or 0
+        }
 
 def performance_monitor(operation: str):
     """Decorator to monitor function performance."""
     def decorator(func: Callable) -> Callable:
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
             success = True
             error_msg = None
             
@@ -235,11 +368,35 @@ def performance_monitor(operation: str):
                 raise
             finally:
                 # Record metrics
-                monitor.record_operation(operation, start_time, success, error_msg)
+                monitor.record_operation(operation, success=success, error=error_msg, start_ns=start_ns)
         
         return wrapper
     return decorator
 
+def _digest_value(digest, value: Any) -> None:
+    """Feed one argument into the key digest, tagged with its type."""
+    digest.update(b"\0" + type(value).__qualname__.encode() + b":")
+    if isinstance(value, str):
+        digest.update(value.encode('utf-8', 'surrogatepass'))
+    elif isinstance(value, (bytes, bytearray)):
+        digest.update(value)
+    else:
+        digest.update(repr(value).encode())
+
+def _default_cache_key(func: Callable, args: tuple, kwargs: Dict[str, Any]) -> str:
+    """Cache key for a call: a typed digest of the function and its arguments.
+    
+    Types are part of the key so 1, True and 1.0 stay distinct, and only the
+    digest is kept, not references to the arguments themselves.
+    """
+    digest = hashlib.blake2b(func.__qualname__.encode(), digest_size=16)
+    for arg in args:
+        _digest_value(digest, arg)
+    for name in sorted(kwargs):
+        digest.update(b"\0" + name.encode() + b"=")
+        _digest_value(digest, kwargs[name])
+    return f"{func.__qualname__}:{digest.hexdigest()}"
+
 def cache_result(key_func: Callable = None, ttl: int = 3600):
     """Decorator to cache function results."""
     def decorator(func: Callable) -> Callable:
@@ -249,7 +406,7 @@ def cache_result(key_func: Callable = None, ttl: int = 3600):
             if key_func:
                 cache_key = key_func(*args, **kwargs)
             else:
-                cache_key = f"{func.__name__}:{hash(str(args) + str(kwargs))}"
+                cache_key = _default_cache_key(func, args, kwargs)
             
             # Try to get from cache
             cached_result = cache.get(cache_key)
@@ -283,6 +440,22 @@ def _cleanup_thread():
         except Exception as e:
             logger.error(f"Error in cleanup thread: {e}")
 
+def _flush_metrics():
+    """Flush every open metrics log."""
+    for open_monitor in list(_open_monitors):
+        open_monitor.flush()
+
+def _flush_thread():
+    """Background thread that flushes buffered metrics in batches."""
+    while True:
+        time.sleep(_FLUSH_INTERVAL)
+        _flush_metrics()
+
 # Start cleanup thread
 _thread = threading.Thread(target=_cleanup_thread, daemon=True)
 _thread.start()
+
+# Start metrics flush thread; whatever is still buffered is written at exit
+_metrics_thread = threading.Thread(target=_flush_thread, daemon=True)
+_metrics_thread.start()
+atexit.register(_flush_metrics)
@@ -3,8 +3,12 @@ Advanced prompt engineering and customization system.
 Provides template management, prompt optimization, and context enhancement.
 """
 
+import os
 import json
 import re
+import time
+import atexit
+import threading
 from typing import Dict, List, Optional, Any, Tuple
 from pathlib import Path
 from dataclasses import dataclass, asdict
@@ -13,6 +17,11 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Template placeholders such as {user_input}; other braces (code, JSON) are left alone
+_VARIABLE_RE = re.compile(r'\{(\w+)\}')
+
+_SAVE_DELAY = 5.0  # Seconds the background writer coalesces template changes for
+
 @dataclass
 class PromptTemplate:
     """A customizable prompt template."""
@@ -57,6 +66,13 @@ class PromptManager:
         
         self.templates: Dict[str, PromptTemplate] = {}
         self.context_windows: Dict[str, ContextWindow] = {}
+        self.revision = 0  # Bumped on every mutation so views can cache snapshots
+        
+        # Changes are written by a background thread, not on the request path
+        self._dirty = threading.Event()
+        self._save_lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._writer_thread = None
         
         self._load_templates()
         self._init_default_templates()
@@ -80,15 +96,41 @@ class PromptManager:
     def _save_templates(self):
         """Save prompt templates to disk."""
         try:
-            templates_data = {
-                tid: asdict(template)
-                for tid, template in self.templates.items()
-            }
-            with open(self.templates_file, 'w') as f:
-                json.dump(templates_data, f, indent=2)
+            with self._save_lock:
+                templates_data = {
+                    tid: asdict(template)
+                    for tid, template in list(self.templates.items())
+                }
+                # Write a sibling file and swap it in, so readers never see a torn file
+                tmp_file = self.templates_file.with_suffix('.json.tmp')
+                with open(tmp_file, 'w') as f:
+                    json.dump(templates_data, f, indent=2)
+                os.replace(tmp_file, self.templates_file)
         except Exception as e:
             logger.error(f"Error saving prompt templates: {e}")
     
+    def _writer(self):
+        """Coalesce template changes into one write every few seconds."""
+        while True:
+            self._dirty.wait()
+            time.sleep(_SAVE_DELAY)
+            self.flush()
+    
+    def _schedule_save(self):
+        """Mark templates dirty; the background writer saves them shortly after."""
+        with self._writer_lock:
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._writer, daemon=True, name="prompt-writer")
+                self._writer_thread.start()
+                atexit.register(self.flush)
+        self._dirty.set()
+    
+    def flush(self):
+        """Write pending template changes to disk now."""
+        if self._dirty.is_set():
+            self._dirty.clear()
+            self._save_templates()
+    
     def _init_default_templates(self):
         """Initialize default prompt templates."""
         default_templates = [
@@ -200,8 +242,10 @@ Be analytical, objective, and evidence-based in your response.""",
         ]
         
         # Add default templates if they don't exist
+        added = False
         for template_data in default_templates:
             if template_data["id"] not in self.templates:
+                added = True
                 template = PromptTemplate(
                     created_at=datetime.now().isoformat(),
                     modified_at=datetime.now().isoformat(),
@@ -211,7 +255,8 @@ Be analytical, objective, and evidence-based in your response.""",
                 )
                 self.templates[template.id] = template
         
-        self._save_templates()
+        if added:
+            self._save_templates()
     
     def _init_context_windows(self):
         """Initialize context window configurations for different models."""
@@ -253,7 +298,8 @@ Be analytical, objective, and evidence-based in your response.""",
         )
         
         self.templates[template_id] = template
-        self._save_templates()
+        self.revision += 1
+        self._schedule_save()
         
         logger.info(f"Created new template: {template.name}")
         return template_id
@@ -271,7 +317,8 @@ Be analytical, objective, and evidence-based in your response.""",
                 setattr(template, key, value)
         
         template.modified_at = datetime.now().isoformat()
-        self._save_templates()
+        self.revision += 1
+        self._schedule_save()
         
         logger.info(f"Updated template: {template.name}")
         return True
@@ -285,18 +332,23 @@ Be analytical, objective, and evidence-based in your response.""",
         try:
             # Update usage count
             template.usage_count += 1
-            self._save_templates()
+            self.revision += 1
+            self._schedule_save()
+            
+            # Replace every placeholder in a single pass over the template,
+            # leaving (and noting) any that have no value
+            missing_vars = []
             
-            # Format the template
-            formatted_prompt = template.template
+            def substitute(match):
+                name = match.group(1)
+                if name in variables:
+                    return str(variables[name])
+                missing_vars.append(name)
+                return match.group(0)
             
-            # Replace variables
-            for var_name, var_value in variables.items():
-                placeholder = "{" + var_name + "}"
-                formatted_prompt = formatted_prompt.replace(placeholder, str(var_value))
+            formatted_prompt = _VARIABLE_RE.sub(substitute, template.template)
             
             # Check for missing variables
-            missing_vars = re.findall(r'\{(\w+)\}', formatted_prompt)
             if missing_vars:
                 logger.warning(f"Missing variables in template {template_id}: {missing_vars}")
             
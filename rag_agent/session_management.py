@@ -7,6 +7,7 @@ import uuid
 import hashlib
 import secrets
 import json
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from pathlib import Path
@@ -51,6 +52,10 @@ class SessionManager:
         self.users: Dict[str, User] = {}
         self.sessions: Dict[str, UserSession] = {}
         self.active_sessions: Dict[str, str] = {}  # session_id -> user_id
+        self.revision = 0  # Bumped on every mutation so views can cache snapshots
+        # Guards the dicts above: the admin flusher snapshots them from its own thread
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
         
         self._load_data()
     
@@ -110,30 +115,32 @@ class SessionManager:
     def _save_data(self):
         """Save users and sessions to disk."""
         try:
-            # Save users
-            users_data = {
-                uid: asdict(user) for uid, user in self.users.items()
-            }
+            # Snapshot under the lock; asdict copies, so the rest runs without it
+            with self._lock:
+                users_data = {
+                    uid: asdict(user) for uid, user in self.users.items()
+                }
+                sessions_data = {
+                    sid: asdict(session) for sid, session in self.sessions.items()
+                }
+            
             # Convert datetime objects to ISO strings
             for uid, data in users_data.items():
                 data['created_at'] = data['created_at'].isoformat() if isinstance(data['created_at'], datetime) else data['created_at']
                 data['last_active'] = data['last_active'].isoformat() if isinstance(data['last_active'], datetime) else data['last_active']
             
-            with open(self.users_file, 'w') as f:
-                json.dump(users_data, f, indent=2)
-            
-            # Save sessions
-            sessions_data = {
-                sid: asdict(session) for sid, session in self.sessions.items()
-            }
             # Convert datetime objects to ISO strings
             for sid, data in sessions_data.items():
                 data['created_at'] = data['created_at'].isoformat() if isinstance(data['created_at'], datetime) else data['created_at']
                 data['last_active'] = data['last_active'].isoformat() if isinstance(data['last_active'], datetime) else data['last_active']
                 data['expires_at'] = data['expires_at'].isoformat() if isinstance(data['expires_at'], datetime) else data['expires_at']
             
-            with open(self.sessions_file, 'w') as f:
-                json.dump(sessions_data, f, indent=2)
+            # Write both files; one writer at a time so they stay a matching pair
+            with self._save_lock:
+                with open(self.users_file, 'w') as f:
+                    json.dump(users_data, f, indent=2)
+                with open(self.sessions_file, 'w') as f:
+                    json.dump(sessions_data, f, indent=2)
             
             logger.debug("Session data saved successfully")
             
@@ -155,7 +162,9 @@ class SessionManager:
             is_active=True
         )
         
-        self.users[user_id] = user
+        with self._lock:
+            self.users[user_id] = user
+            self.revision += 1
         self._save_data()
         
         logger.info(f"Created user: {username} (ID: {user_id})")
@@ -165,13 +174,14 @@ class SessionManager:
         """Get or create an anonymous user for single-user mode."""
         anonymous_username = "anonymous"
         
-        # Find existing anonymous user
-        for user_id, user in self.users.items():
-            if user.username == anonymous_username:
-                return user_id
-        
-        # Create new anonymous user
-        return self.create_user(anonymous_username, preferences={"theme": "light"})
+        with self._lock:
+            # Find existing anonymous user
+            for user_id, user in self.users.items():
+                if user.username == anonymous_username:
+                    return user_id
+            
+            # Create new anonymous user
+            return self.create_user(anonymous_username, preferences={"theme": "light"})
     
     def create_session(self, user_id: str, duration_hours: int = 24, ip_address: str = None, user_agent: str = None) -> str:
         """Create a new session for a user."""
@@ -193,12 +203,14 @@ class SessionManager:
             is_active=True
         )
         
-        self.sessions[session_id] = session
-        self.active_sessions[session_id] = user_id
-        
-        # Update user last active
-        self.users[user_id].last_active = current_time
-        
+        with self._lock:
+            self.sessions[session_id] = session
+            self.active_sessions[session_id] = user_id
+            
+            # Update user last active
+            self.users[user_id].last_active = current_time
+            
+            self.revision += 1
         self._save_data()
         
         logger.info(f"Created session {session_id} for user {user_id}")
@@ -225,43 +237,48 @@ class SessionManager:
         if not session:
             return False
         
-        session.expires_at = datetime.now() + timedelta(hours=hours)
-        session.last_active = datetime.now()
-        
-        # Update user last active
-        if session.user_id in self.users:
-            self.users[session.user_id].last_active = datetime.now()
-        
+        with self._lock:
+            session.expires_at = datetime.now() + timedelta(hours=hours)
+            session.last_active = datetime.now()
+            
+            # Update user last active
+            if session.user_id in self.users:
+                self.users[session.user_id].last_active = datetime.now()
+            
+            self.revision += 1
         self._save_data()
         return True
     
     def end_session(self, session_id: str) -> bool:
         """End a session."""
-        if session_id in self.sessions:
+        with self._lock:
+            if session_id not in self.sessions:
+                return False
             self.sessions[session_id].is_active = False
-            if session_id in self.active_sessions:
-                del self.active_sessions[session_id]
-            self._save_data()
-            logger.info(f"Ended session {session_id}")
-            return True
-        return False
+            self.active_sessions.pop(session_id, None)
+            self.revision += 1
+        self._save_data()
+        logger.info(f"Ended session {session_id}")
+        return True
     
     def get_user_sessions(self, user_id: str) -> List[UserSession]:
         """Get all active sessions for a user."""
         current_time = datetime.now()
-        return [
-            session for session in self.sessions.values()
-            if session.user_id == user_id and session.is_active and session.expires_at > current_time
-        ]
+        with self._lock:
+            return [
+                session for session in self.sessions.values()
+                if session.user_id == user_id and session.is_active and session.expires_at > current_time
+            ]
     
     def cleanup_expired_sessions(self) -> int:
         """Clean up expired sessions."""
         current_time = datetime.now()
         expired_sessions = []
         
-        for session_id, session in self.sessions.items():
-            if session.expires_at <= current_time or not session.is_active:
-                expired_sessions.append(session_id)
+        with self._lock:
+            for session_id, session in self.sessions.items():
+                if session.expires_at <= current_time or not session.is_active:
+                    expired_sessions.append(session_id)
         
         for session_id in expired_sessions:
             self.end_session(session_id)
@@ -287,8 +304,10 @@ class SessionManager:
         if not session:
             return False
         
-        session.data[key] = value
-        session.last_active = datetime.now()
+        with self._lock:
+            session.data[key] = value
+            session.last_active = datetime.now()
+            self.revision += 1
         self._save_data()
         return True
     
@@ -302,10 +321,11 @@ class SessionManager:
         
         # Recent activity (last 24 hours)
         recent_cutoff = current_time - timedelta(hours=24)
-        recent_sessions = sum(
-            1 for session in self.sessions.values()
-            if session.last_active > recent_cutoff
-        )
+        with self._lock:
+            recent_sessions = sum(
+                1 for session in self.sessions.values()
+                if session.last_active > recent_cutoff
+            )
         
         return {
             "active_sessions": active_sessions,
@@ -27,7 +27,7 @@ st.set_page_config(
 # Import our modules (with error handling for development)
 try:
     from .config import config_manager
-    from .agent import rag_agent
+    from .agent import get_rag_agent
     from .ingestion import DocumentIngestion
     from .retrieval import DocumentRetrieval
     from .admin import show_admin_panel, show_code_playground, add_admin_to_navigation
@@ -478,6 +478,13 @@ def render_chat_page():
         # Generate and display response
         generate_response(prompt)
 
+def knowledge_base_changed():
+    """Drop RAG contexts cached before documents were added or removed."""
+    try:
+        get_rag_agent().clear_semantic_cache()
+    except Exception as e:
+        logger.error(f"Error clearing semantic cache: {e}")
+
 def process_uploaded_files(uploaded_files):
     """Process uploaded files and add to vector store."""
     if not st.session_state.ingestion:
@@ -486,29 +493,51 @@ def process_uploaded_files(uploaded_files):
     
     with st.spinner(f"Processing {len(uploaded_files)} file(s)..."):
         success_count = 0
-        for uploaded_file in uploaded_files:
-            try:
-                # Save file temporarily
+        skipped_count = 0
+        tmp_paths = []
+        try:
+            # Save files temporarily
+            for uploaded_file in uploaded_files:
                 with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
                     tmp_file.write(uploaded_file.getvalue())
-                    tmp_file_path = tmp_file.name
-                
-                # Process the file
-                st.session_state.ingestion.ingest_document(tmp_file_path, uploaded_file.name)
-                
-                # Clean up
-                os.unlink(tmp_file_path)
+                    tmp_paths.append(tmp_file.name)
+            
+            # Process all files in one batch
+            results = st.session_state.ingestion.ingest_multiple_documents(
+                tmp_paths, [uploaded_file.name for uploaded_file in uploaded_files]
+            )
+            
+            for uploaded_file, result in zip(uploaded_files, results):
+                if result['status'] == 'error':
+                    st.error(f"Error processing {uploaded_file.name}: {result.get('error', 'Unknown error')}")
+                    continue
+                if result['status'] == 'skipped':
+                    # Duplicate or unchanged file: nothing new was added to the knowledge base
+                    skipped_count += 1
+                    skipped_msg = f"ℹ️ File '{uploaded_file.name}' skipped: {result['message']}."
+                    st.session_state.current_messages.append({"role": "assistant", "content": skipped_msg})
+                    continue
                 success_count += 1
                 
                 # Add confirmation to chat
                 confirmation_msg = f"✅ File '{uploaded_file.name}' processed and added to context."
                 st.session_state.current_messages.append({"role": "assistant", "content": confirmation_msg})
                 
-            except Exception as e:
-                st.error(f"Error processing {uploaded_file.name}: {e}")
+        except Exception as e:
+            st.error(f"Error processing files: {e}")
+        finally:
+            # Clean up
+            for tmp_path in tmp_paths:
+                os.unlink(tmp_path)
+        
+        if skipped_count > 0:
+            st.info(f"Skipped {skipped_count} file(s) already in the knowledge base")
         
         if success_count > 0:
+            knowledge_base_changed()
             st.success(f"Successfully processed {success_count} file(s)!")
+        
+        if success_count or skipped_count:
             save_current_session()
             st.rerun()
 
@@ -525,7 +554,7 @@ def generate_response(prompt: str):
                 relevant_docs = st.session_state.retrieval.retrieve_documents(prompt, top_k=5)
                 
                 # Generate response using the agent
-                response = rag_agent.generate_response(
+                response = get_rag_agent().generate_response(
                     query=prompt,
                     context_docs=relevant_docs,
                     chat_history=st.session_state.current_messages[-10:],  # Last 10 messages
@@ -846,6 +875,7 @@ def show_sidebar():
 def show_chat_page():
     """Display the main chat interface."""
     st.title("💬 Chat with RAG Agent")
+    rag_agent = get_rag_agent()
     
     # Check if agent is ready
     if not rag_agent.current_model:
@@ -942,7 +972,10 @@ def show_chat_page():
                         os.unlink(tmp_path)
                         
                         if result['status'] == 'success':
+                            knowledge_base_changed()
                             st.success(f"✅ Successfully processed {uploaded_file.name} ({result['num_chunks']} chunks)")
+                        elif result['status'] == 'skipped':
+                            st.info(f"ℹ️ {uploaded_file.name} is unchanged: {result['message']}")
                         else:
                             st.error(f"❌ Error processing {uploaded_file.name}: {result.get('error', 'Unknown error')}")
                             
@@ -957,11 +990,9 @@ def show_chat_page():
         with st.chat_message("user"):
             st.write(user_input)
             
-        # Generate response
+        # Stream the response as the model produces it
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response = rag_agent.chat(user_input, use_rag=True)
-                st.write(response)
+            st.write_stream(rag_agent.stream_chat(user_input, use_rag=True))
                 
         # Rerun to update the display
         st.rerun()
@@ -1140,6 +1171,7 @@ def show_documents_page():
                     with col2:
                         if st.button(f"🗑️ Delete", key=f"delete_{file_info['name']}", type="secondary"):
                             if st.session_state.ingestion.delete_document(file_info['name']):
+                                knowledge_base_changed()
                                 st.success(f"Deleted {file_info['name']}")
                                 st.rerun()
                             else:
@@ -1184,6 +1216,7 @@ def show_documents_page():
                 st.session_state.confirm_clear = True
             else:
                 if st.session_state.ingestion.clear_all_documents():
+                    knowledge_base_changed()
                     st.success("All documents cleared!")
                     del st.session_state.confirm_clear
                     st.rerun()
@@ -1245,7 +1278,7 @@ def show_configuration_page():
             selected_key = model_keys[selected_idx]
             
             if st.button("🔄 Switch to Selected Model"):
-                if rag_agent.switch_model(selected_key):
+                if get_rag_agent().switch_model(selected_key):
                     st.success(f"Switched to {config_manager.config.models[selected_key].name}")
                     st.rerun()
                 else: